@@ -0,0 +1,519 @@
+#!/usr/bin/env python3
+#
+# Batched compression experiments: many small samples with the same layout
+# (e.g. realizations of a rock sample with different seeds) are compressed
+# in lock-step in one process. Their states are stacked in arrays with one
+# line per sample, and every step of the experiment (displacements,
+# vertical force, compaction checks, next compaction in event driven mode)
+# is evaluated for the whole batch at once, which removes the per-sample
+# Python overhead of Compression.
+#
+# The linear system is the symmetric reformulation of solvers.SymmetricSolver
+# (stiffness matrix K of the network; the imposed displacements and the
+# horizontal translation are eliminated). With the nodes numbered row by
+# row, K is block tridiagonal (one block per row of nodes, the springs only
+# link adjacent rows) and it is factorized by block Gaussian elimination,
+# vectorized over the samples; the compactions are then taken into account
+# by low-rank corrections, as in solvers.WoodburySolver. As in the event
+# driven mode of Compression, the displacements of a sample are
+# u = u_F + d * u_d, and the two basis solutions are only computed again
+# when its compaction state changes.
+
+import numpy
+import scipy.sparse
+
+from compression import Step
+
+
+class Batch:
+    '''Compression experiments of the samples (list of RockSample with the
+    same dimensions and elastic parameters, Rl and Ke of every spring
+    included, e.g. created with different seeds) advanced in lock-step. The
+    parameters of the experiment are those of Compression, and are the same
+    for all the samples.
+
+    The run method is a generator yielding (sample index, compression.Step)
+    pairs, one for every active sample at every step. The state of the
+    samples (rs.u, rs.compacted, rs.comp_count) is updated as the experiment
+    goes on, and the compactions are written to their event logs (see
+    event_log.py) if they have one. The results are those of Compression
+    with the same parameters, up to the round-off errors of the solver.
+
+    The factorization of the stiffness matrix of every sample is kept while
+    less than max_rank springs have been compacted since (see update). Its
+    size is proportional to nlines * ncols^2: the batches are meant for
+    small samples.
+    '''
+
+    # Relative overshoot of the compaction displacement in event driven
+    # mode (see Compression)
+    event_tol = 1e-9
+
+    def __init__(self, samples, F0x=0, Kbc=20, d0=0., delta_d=0.005,
+                 max_comp=40, event_driven=False, max_rank=16):
+        rs = self.rs = samples[0]
+        for other in samples[1:]:
+            if ((other.l, other.c, other.leq0, other.alpha0, other.Ka) !=
+                    (rs.l, rs.c, rs.leq0, rs.alpha0, rs.Ka) or
+                    not numpy.array_equal(other.spring_Rl, rs.spring_Rl) or
+                    not numpy.array_equal(other.spring_Ke, rs.spring_Ke)):
+                raise ValueError("The samples of a batch must have the same "
+                                 "dimensions and elastic parameters")
+        self.samples = samples
+        self.F0x = F0x
+        self.Kbc = Kbc
+        self.delt_d = delta_d
+        self.max_comp = max_comp
+        self.event_driven = event_driven
+        self.max_rank = max_rank
+
+        # State of the samples, one line per sample; the arrays of the
+        # samples are views of these lines
+        B = len(samples)
+        n = rs.n
+        self.Fcr = numpy.array([s.Fcr for s in samples])
+        self.compacted = numpy.array([s.compacted for s in samples])
+        self.u = numpy.array([s.u for s in samples], dtype=float)
+        for b, s in enumerate(samples):
+            s.Fcr = self.Fcr[b]
+            s.compacted = self.compacted[b]
+            s.u = self.u[b]
+        self.comp_count = numpy.array([s.comp_count for s in samples])
+        self.d = numpy.full(B, float(d0))
+        self.Fy = numpy.zeros(B)
+        self.iteration = numpy.zeros(B, dtype=int)
+        # the first step of every sample starts with an increment of d
+        self.increment_pending = numpy.ones(B, dtype=bool)
+        self.new_compacted = [numpy.zeros(0, dtype=int)] * B
+        self.u_F = numpy.zeros((B, 2 * n))
+        self.u_d = numpy.zeros((B, 2 * n))
+        # samples whose compaction state changed since u_F and u_d were
+        # computed
+        self.changed = numpy.ones(B, dtype=bool)
+
+        self.alpha_comp = rs.compacted_stiffness()
+        self.alpha_c = rs.compaction_stiffness(Kbc)
+        self.build_layout()
+        self.build_assembly()
+        self.build_prestress()
+        # factorization of the reference matrices K0 (see factorize) and
+        # compaction state of K0
+        R, m = self.R, self.m
+        self.Sinv = numpy.empty((B, R, m, m))
+        self.X = numpy.empty((B, R - 1, m, m))
+        self.E = numpy.empty((B, R - 1, m, m))
+        self.compacted_K = numpy.zeros_like(self.compacted)
+        self.factorized = numpy.zeros(B, dtype=bool)
+
+        # Initial state (d = d0), as in Compression
+        self.solve(numpy.arange(B))
+
+    def build_layout(self):
+        '''Numbering of the degrees of freedom by blocks: block r holds the
+        (ux, uy) pairs of the nodes of row r, in the order of the nodes. The
+        short rows are padded with dummy degrees of freedom (identity
+        equations).'''
+        rs = self.rs
+        n = rs.n
+        i = numpy.arange(n)
+        r = i % rs.len2lines
+        row = i // rs.len2lines * 2 + r // rs.c
+        local = numpy.where(r < rs.c, r, r - rs.c)
+        self.R = rs.l
+        self.m = 2 * rs.c
+        # position of every degree of freedom (ux then uy) in the flattened
+        # (R, m) blocks
+        self.position = numpy.concatenate((row * self.m + 2 * local,
+                                           row * self.m + 2 * local + 1))
+        # eliminated degrees of freedom: uy of the top and bottom rows, ux
+        # of node 0 (translation) and the dummy degrees of freedom
+        fixed = numpy.ones(self.R * self.m, dtype=bool)
+        fixed[self.position] = numpy.concatenate(
+            ([True], numpy.zeros(n - 1, dtype=bool), rs.top | rs.bottom))
+        self.fixed = fixed.reshape(self.R, self.m)
+        # imposed displacements for d = 1
+        g = numpy.zeros(2 * n)
+        g[n:][rs.top] = 0.5
+        g[n:][rs.bottom] = -0.5
+        self.g = self.to_blocks(g[None])[0]
+        # the ux equations of the top and bottom rows are divided by Kbc
+        self.scale = numpy.ones(2 * n)
+        self.scale[:n][rs.top | rs.bottom] = 1. / self.Kbc
+
+    def to_blocks(self, u):
+        '''(k, 2n) array -> (k, R, m) blocks'''
+        blocks = numpy.zeros((len(u), self.R * self.m))
+        blocks[:, self.position] = u
+        return blocks.reshape(len(u), self.R, self.m)
+
+    def from_blocks(self, blocks):
+        '''(k, R, m) blocks -> (k, 2n) array'''
+        return blocks.reshape(len(blocks), -1)[:, self.position]
+
+    def build_assembly(self):
+        '''Sparse matrices giving, for the stiffnesses a (one line per
+        sample) of the springs, the (flattened) diagonal blocks and lower
+        blocks K[r+1, r] of K, a assembly + identity, and the product of K
+        with the imposed displacements g, a assembly_g. Each spring adds
+        a N to the diagonal blocks of its ends and -a N between them
+        (N = n n^T). The rows and columns of the eliminated degrees of
+        freedom are replaced by identity equations.'''
+        rs = self.rs
+        n = rs.n
+        R, m = self.R, self.m
+        fixed = self.fixed.ravel()
+        g = self.g.ravel()
+        normal = rs.spring_normals
+        N = normal[:, :, None] * normal[:, None, :]
+        i = rs.springs[:, 0]
+        k = rs.springs[:, 1]
+        position = self.position[numpy.array([i, i + n, k, k + n]).T]
+        block = position // m
+        local = position % m
+        sign = (1., 1., -1., -1.)
+        K = ([], [], [])
+        Kg = ([], [], [])
+        for p in range(4):
+            for q in range(4):
+                value = sign[p] * sign[q] * N[:, p % 2, q % 2]
+                free = ((value != 0) & ~fixed[position[:, p]] &
+                        ~fixed[position[:, q]])
+                diagonal = block[:, p] == block[:, q]
+                lower = block[:, p] == block[:, q] + 1
+                entry = numpy.where(
+                    diagonal,
+                    (block[:, p] * m + local[:, p]) * m + local[:, q],
+                    (R + block[:, q]) * m * m + local[:, p] * m + local[:, q])
+                keep = free & (diagonal | lower)
+                for lst, values in zip(K, (numpy.flatnonzero(keep),
+                                           entry[keep], value[keep])):
+                    lst.append(values)
+                # columns of the imposed displacements
+                keep = ((value != 0) & ~fixed[position[:, p]] &
+                        fixed[position[:, q]] & (g[position[:, q]] != 0))
+                for lst, values in zip(Kg, (numpy.flatnonzero(keep),
+                                            position[keep, p],
+                                            value[keep] *
+                                            g[position[keep, q]])):
+                    lst.append(values)
+        # the spring vectors (n, -n) of the low-rank corrections (see update)
+        self.spring_positions = position
+        self.spring_columns = numpy.where(
+            fixed[position], 0., numpy.array(sign) *
+            numpy.hstack((normal, normal)))
+        springs, entries, values = (numpy.concatenate(lst) for lst in K)
+        self.assembly = scipy.sparse.csr_matrix(
+            (values, (springs, entries)),
+            shape=(rs.nsprings, (2 * R - 1) * m * m))
+        springs, entries, values = (numpy.concatenate(lst) for lst in Kg)
+        self.assembly_g = scipy.sparse.csr_matrix(
+            (values, (springs, entries)), shape=(rs.nsprings, R * m))
+        self.identity = numpy.zeros((2 * R - 1) * m * m)
+        rows = numpy.flatnonzero(fixed)
+        self.identity[rows * m + rows % m] = 1.
+
+    def build_prestress(self):
+        '''Forces applied to every node by each of its compacted springs (in
+        the order of rs.normals), see Compression.build_F'''
+        rs = self.rs
+        border = rs.top | rs.bottom
+        alpha = self.alpha_comp[rs.node_springs]
+        alpha = numpy.where(border[:, None], alpha * self.Kbc, alpha)
+        f = -alpha * rs.leq0 * (1 - rs.spring_Rl[rs.node_springs])
+        normals = numpy.array(rs.normals)
+        self.prestress_x = f * normals[:, 0]
+        self.prestress_y = numpy.where(border[:, None], 0.,
+                                       f * normals[:, 1])
+
+    def build_F(self, samples):
+        '''Right-hand sides F (Compression.build_F) of the samples for
+        d = 0'''
+        rs = self.rs
+        compacted = (self.compacted[samples][:, rs.node_springs] &
+                     (rs.node_springs >= 0))
+        Fx = (compacted * self.prestress_x).sum(axis=2)
+        Fy = (compacted * self.prestress_y).sum(axis=2)
+        Fx[:, rs.left] += self.F0x
+        Fx[:, rs.right & ~rs.left] -= self.F0x
+        return numpy.hstack((Fx, Fy))
+
+    def stiffness(self, compacted, springs=slice(None)):
+        '''Stiffness of the springs (or of the springs springs) for the
+        compaction states compacted'''
+        return numpy.where(compacted, self.alpha_comp[springs],
+                           self.rs.alpha0)
+
+    def factorize(self, samples):
+        '''Assembles and factorizes K for the samples by block Gaussian
+        elimination: S[0] = D[0] and S[r+1] = D[r+1] - E[r] X[r], with
+        X[r] = S[r]^-1 E[r]^T (D[r] and E[r] are the diagonal and lower
+        blocks of K). This factorization is the reference of the low-rank
+        corrections of update.'''
+        R, m = self.R, self.m
+        k = len(samples)
+        K = (numpy.asarray(self.stiffness(self.compacted[samples]) @
+                           self.assembly) + self.identity)
+        D = K[:, :R * m * m].reshape(k, R, m, m)
+        E = K[:, R * m * m:].reshape(k, R - 1, m, m)
+        Sinv = numpy.empty((k, R, m, m))
+        X = numpy.empty((k, R - 1, m, m))
+        S = D[:, 0]
+        for r in range(R):
+            Sinv[:, r] = numpy.linalg.inv(S)
+            if r < R - 1:
+                X[:, r] = Sinv[:, r] @ E[:, r].transpose(0, 2, 1)
+                S = D[:, r + 1] - E[:, r] @ X[:, r]
+        self.Sinv[samples] = Sinv
+        self.X[samples] = X
+        self.E[samples] = E
+        self.compacted_K[samples] = self.compacted[samples]
+        self.factorized[samples] = True
+
+    def solve_factorized(self, samples, b):
+        '''Solves K0 x = b (b: k x R x m x columns) for the factorized
+        matrices K0 of the samples'''
+        R = self.R
+        if len(samples) == len(self.samples):
+            # all the samples: no copy of the factorizations
+            samples = slice(None)
+        Sinv = self.Sinv[samples]
+        X = self.X[samples]
+        E = self.E[samples]
+        # forward elimination: z[r] = S[r]^-1 (b[r] - E[r-1] z[r-1])
+        z = numpy.empty_like(b)
+        c = b[:, 0]
+        for r in range(R):
+            z[:, r] = Sinv[:, r] @ c
+            if r < R - 1:
+                c = b[:, r + 1] - E[:, r] @ z[:, r]
+        # back substitution: x[r] = z[r] - X[r] x[r+1]
+        for r in range(R - 2, -1, -1):
+            z[:, r] -= X[:, r] @ z[:, r + 1]
+        return z
+
+    def update(self, samples):
+        '''Computes the basis solutions u_F and u_d of the samples whose
+        compaction state changed. The springs compacted since the
+        factorization of K0 add a N to K (see build_assembly): K = K0 +
+        U diag(delta) U^T, and K^-1 is applied with the Woodbury formula
+        (see solvers.WoodburySolver). K is factorized again when the rank of
+        the correction exceeds max_rank.'''
+        samples = samples[self.changed[samples]]
+        if len(samples) == 0:
+            return
+        extra = self.compacted[samples] != self.compacted_K[samples]
+        rank = extra.sum(axis=1)
+        refactorize = ~self.factorized[samples] | (rank > self.max_rank)
+        if refactorize.any():
+            self.factorize(samples[refactorize])
+            extra[refactorize] = False
+            rank[refactorize] = 0
+        R, m = self.R, self.m
+        k = len(samples)
+        r = rank.max()
+
+        # columns of U, then right-hand sides for d = 0 (F_F) and for the
+        # imposed displacements (d = 1), whose columns are moved to the
+        # right-hand side
+        compacted = self.compacted[samples]
+        b = numpy.zeros((k, R * m, r + 2))
+        lines, springs = numpy.nonzero(extra)
+        columns = (numpy.arange(len(lines)) -
+                   numpy.concatenate(([0], numpy.cumsum(rank)[:-1]))[lines])
+        for p in range(4):
+            b[lines, self.spring_positions[springs, p], columns] = \
+                self.spring_columns[springs, p]
+        delta = numpy.zeros((k, r))
+        delta[lines, columns] = (
+            self.stiffness(compacted[lines, springs], springs) -
+            self.stiffness(self.compacted_K[samples][lines, springs],
+                           springs))
+        b[..., r] = (self.to_blocks(-self.scale * self.build_F(samples)) *
+                     ~self.fixed).reshape(k, -1)
+        b[..., r + 1] = (self.g.ravel() -
+                         numpy.asarray(self.stiffness(compacted) @
+                                       self.assembly_g))
+
+        y = self.solve_factorized(samples, b.reshape(k, R, m, r + 2))
+        y = y.reshape(k, R * m, r + 2)
+        x = y[..., r:]
+        if r > 0:
+            U = b[..., :r]
+            Z = y[..., :r]
+            C = (numpy.eye(r) +
+                 delta[:, :, None] * (U.transpose(0, 2, 1) @ Z))
+            x = x - Z @ numpy.linalg.solve(
+                C, delta[:, :, None] * (U.transpose(0, 2, 1) @ x))
+        self.u_F[samples] = self.from_blocks(x[..., 0])
+        self.u_d[samples] = self.from_blocks(x[..., 1])
+        self.changed[samples] = False
+
+    def spring_displacements(self, u):
+        '''Relative displacements (x, y) of the ends of the springs of every
+        sample (lines of u)'''
+        rs = self.rs
+        n = rs.n
+        i = rs.springs[:, 0]
+        k = rs.springs[:, 1]
+        return u[:, k] - u[:, i], u[:, k + n] - u[:, i + n]
+
+    def spring_vectors(self, u):
+        '''Components (x, y) of the springs of every sample (lines of u)'''
+        rs = self.rs
+        dx, dy = self.spring_displacements(u)
+        return (rs.spring_normals[:, 0] * rs.leq0 + dx,
+                rs.spring_normals[:, 1] * rs.leq0 + dy)
+
+    def vertical_force_applied(self, samples):
+        '''Mean vertical force of the samples, see
+        Compression.vertical_force_applied'''
+        rs = self.rs
+        n = rs.n
+        u = self.u[samples]
+        compacted = self.compacted[samples]
+
+        def boundary_force(nodes, directions):
+            Fyi = numpy.zeros((len(samples), len(nodes)))
+            for j in directions:
+                nx, ny = rs.normals[j]
+                k = rs.neighbours[nodes, j]
+                present = k >= 0
+                springs = rs.node_springs[nodes, j]
+                c = compacted[:, springs] & present
+                du = (u[:, k] - u[:, nodes]) * nx + \
+                     (u[:, k + n] - u[:, nodes + n]) * ny
+                f = numpy.where(c, self.alpha_comp[springs] *
+                                (du + rs.leq0 * (1 - rs.spring_Rl[springs])),
+                                rs.alpha0 * du)
+                Fyi = numpy.where(present, (Fyi + f) * ny, Fyi)
+            return Fyi
+
+        Fy_bottom = boundary_force(numpy.flatnonzero(rs.bottom), (3, 2))
+        Fy_top = boundary_force(numpy.flatnonzero(rs.top), (4, 5))
+        self.Fy[samples] = ((numpy.abs(Fy_top).sum(axis=1) +
+                             numpy.abs(Fy_bottom).sum(axis=1)) /
+                            (Fy_top.shape[1] + Fy_bottom.shape[1]))
+
+    def find_compacted(self, samples):
+        '''Compaction check of the samples (see RockSample.find_compacted)'''
+        rs = self.rs
+        x, y = self.spring_vectors(self.u[samples])
+        force = -self.alpha_c * (numpy.sqrt(x**2 + y**2) - rs.leq0)
+        new = (force > self.Fcr[samples]) & ~self.compacted[samples]
+        self.compacted[samples] |= new
+        lines, springs = numpy.nonzero(new)
+        counts = numpy.bincount(lines, minlength=len(samples))
+        self.comp_count[samples] += counts
+        self.changed[samples] |= counts > 0
+        new_springs = numpy.split(springs, numpy.cumsum(counts)[:-1])
+        for line, b in enumerate(samples):
+            rs_b = self.samples[b]
+            new_b = new_springs[line]
+            self.new_compacted[b] = new_b
+            rs_b.comp_count = int(self.comp_count[b])
+            if rs_b.event_log is not None and len(new_b) > 0:
+                rs_b.event_log.write(self.iteration[b], self.d[b], new_b,
+                                     force[line, new_b], self.Fcr[b, new_b])
+
+    def next_compaction(self, samples, direction):
+        '''Applied displacement of the next compaction of the samples (see
+        RockSample.next_compaction), nan if no spring can be compacted'''
+        rs = self.rs
+        s = direction
+        L = rs.leq0 - self.Fcr[samples] / self.alpha_c
+        px, py = self.spring_vectors(self.u_F[samples])
+        bx, by = self.spring_displacements(s * self.u_d[samples])
+        a2 = bx**2 + by**2
+        a1 = px * bx + py * by
+        a0 = px**2 + py**2 - L**2
+        delta = a1**2 - a2 * a0
+        ok = ~self.compacted[samples] & (L > 0) & (a2 > 0) & (delta > 0)
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            r = (-a1 - numpy.sqrt(delta)) / a2
+        r = numpy.where(ok & (r > s * self.d[samples, None]), r, numpy.inf)
+        r = r.min(axis=1)
+        return numpy.where(numpy.isinf(r), numpy.nan, s * r)
+
+    def increment_d(self, samples):
+        '''Increments the applied displacement of the samples (see
+        Compression.increment_d)'''
+        if not self.event_driven:
+            self.d[samples] += self.delt_d
+            return
+        self.update(samples)
+        direction = -1 if self.delt_d < 0 else 1
+        d = self.next_compaction(samples, direction)
+        self.d[samples] = numpy.where(
+            numpy.isnan(d), self.d[samples] + self.delt_d,
+            d + direction * self.event_tol * numpy.maximum(1., numpy.abs(d)))
+
+    def solve(self, samples):
+        '''Displacements, vertical force and compaction check of the
+        samples for their current applied displacement'''
+        self.update(samples)
+        self.u[samples] = (self.u_F[samples] +
+                           self.d[samples, None] * self.u_d[samples])
+        self.vertical_force_applied(samples)
+        self.find_compacted(samples)
+
+    def comp_rate(self, samples):
+        return self.comp_count[samples] / self.rs.nsprings * 100
+
+    def run(self, max_iterations=None):
+        '''Generator running the experiments in lock-step (see
+        Compression.run): every step of the batch yields (sample index,
+        Step) for each of the samples whose compaction rate is below
+        max_comp. The experiments end after max_iterations steps, and can
+        be continued by another call to run.'''
+        active = numpy.arange(len(self.samples))
+        count = 0
+        while True:
+            active = active[self.comp_rate(active) < self.max_comp]
+            if len(active) == 0:
+                return
+            if max_iterations is not None and count >= max_iterations:
+                return
+            pending = active[self.increment_pending[active]]
+            if len(pending) > 0:
+                self.increment_d(pending)
+                self.increment_pending[pending] = False
+            count += 1
+            self.iteration[active] += 1
+            self.solve(active)
+            h0 = self.rs.h0
+            for b in active:
+                new = self.new_compacted[b]
+                self.increment_pending[b] = len(new) == 0
+                yield b, Step(int(self.iteration[b]), self.d[b],
+                              self.d[b] / h0 * 100, self.Fy[b],
+                              self.comp_count[b] / self.rs.nsprings * 100,
+                              new)
+
+
+# Example: throughput of a batch of realizations of a small sample, compared
+# to the same experiments run one after the other by Compression
+if __name__ == '__main__':
+    import time
+    from echantillon import RockSample
+    from compression import Compression
+
+    nsamples = 32
+    for event_driven in (False, True):
+        start = time.time()
+        for seed in range(nsamples):
+            cpr = Compression(RockSample(23, 15, D = 0.05, seed = seed),
+                              event_driven = event_driven)
+            for step in cpr.run():
+                pass
+        loop = time.time() - start
+
+        start = time.time()
+        batch = Batch([RockSample(23, 15, D = 0.05, seed = seed)
+                       for seed in range(nsamples)],
+                      event_driven = event_driven)
+        for b, step in batch.run():
+            pass
+        batched = time.time() - start
+        print("event_driven=%s: %.1f samples/s with Compression, "
+              "%.1f samples/s in a batch of %d" %
+              (event_driven, nsamples / loop, nsamples / batched, nsamples))
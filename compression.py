@@ -1,23 +1,57 @@
 
+import os
+import json
+import time
 from math import sqrt
+from collections import namedtuple
 import numpy
 import scipy.sparse
-#from scipy.sparse.linalg import spsolve
-from numpy.linalg import solve
 
+import echantillon
 from echantillon import RockSample, StratifiedRockSample
+from solvers import get_solver
+from strips import StripPool, map_strips
 
-#TEST
-from  display_curve import DisplayCurve
-from display_rock_sample import DisplayRS
-from tkinter import *
-import threading
+# Enregistrement produit a chaque etape de l'experience par Compression.run :
+# numero de l'etape, deplacement applique, deformation (%), force verticale
+# moyenne, taux de compaction (%), indices des ressorts compactes pendant
+# l'etape et, pour les solveurs iteratifs, nombre d'iterations et residu
+# relatif des resolutions de l'etape (None pour les solveurs directs)
+Step = namedtuple('Step', ['iteration', 'd', 'strain', 'Fy', 'comp_rate',
+                           'new', 'solver_iterations', 'residual'],
+                  defaults=(None, None))
+
+
+def json_value(value):
+    '''Conversion en type Python des scalaires numpy (par exemple des
+    parametres tires de numpy.arange) pour l'ecriture des points de
+    reprise en JSON'''
+    if isinstance(value, numpy.generic):
+        return value.item()
+    raise TypeError("Object of type %s is not JSON serializable" %
+                    type(value).__name__)
 
 class Compression:
     '''On definit l'experience de compression par son echantillon de gre rs, la
     force de confinement horizontale F0x, le rapport d'augmentation de la 
     raideur des ressorts par friction Kbc et l'intervalle de deformation 
-    applique a chaque etape de l'experience delta_d.'''
+    applique a chaque etape de l'experience delta_d.
+    Le parametre solver choisit la methode de resolution du systeme lineaire
+    ('sparse' par defaut, 'dense' pour la resolution de reference,
+    'woodbury', 'iterative', 'symmetric', ou une instance d'un solveur du
+    module solvers, par exemple IterativeSolver(tol=1e-8)).
+    Les forces et les criteres de compaction des ressorts sont evalues par
+    bandes horizontales de l'echantillon, en parallele par workers threads
+    si workers > 1 (voir strips.py) ; les resultats ne dependent pas du
+    nombre de threads. Les threads sont arretes par close, ou a la sortie
+    d'un bloc with :
+
+        with Compression(rs, workers = 4) as cpr:
+            for step in cpr.run():
+                ...
+    En mode evenementiel (event_driven=True), le deplacement n'est pas
+    incremente de delta_d mais avance directement jusqu'a la compaction du
+    prochain ressort.'''
     
     # Vecteurs unitaires de l'axe des ressorts (l'axe y point vers le bas)
     ng = (-1, 0)
@@ -26,8 +60,12 @@ class Compression:
     nhd = (0.5, -sqrt(3)/2)
     nbg = (-0.5, sqrt(3)/2)
     nbd = (0.5, sqrt(3)/2)
+
+    # Depassement relatif du deplacement de compaction en mode evenementiel
+    event_tol = 1e-9
     
-    def __init__(self, rs, F0x=0, Kbc=20, d0 = 0., delta_d=0.005, max_comp=40):
+    def __init__(self, rs, F0x=0, Kbc=20, d0 = 0., delta_d=0.005, max_comp=40,
+                 solver='sparse', event_driven=False, workers=1):
         # echantillon de gre
         self.rs = rs
         # force horizontale de confinement
@@ -41,242 +79,508 @@ class Compression:
         # a chaque etape de l'experience
         self.delt_d = delta_d
         # deplacement cumule
+        self.d0 = d0
         self.d = d0
         # pourcentage maximal de ressorts compactes (utilisé comme condition
         # pour terminer l'experience)
         self.max_comp = max_comp
+        # solveur du systeme lineaire ; la factorisation de A est conservee
+        # tant que l'etat de compaction (compacted_A) ne change pas
+        self.solver_name = solver if isinstance(solver, str) else None
+        self.solver = get_solver(solver)
+        # les solveurs qui dependent de la structure de l'echantillon
+        if hasattr(self.solver, 'bind'):
+            self.solver.bind(self)
+        self.A = None
+        self.compacted_A = None
+        # threads evaluant les ressorts et les noeuds par bandes
+        self.workers = workers
+        self.pool = StripPool(workers)
+        # Mode evenementiel : pour un etat de compaction donne, u est une
+        # fonction affine de d, u = u_F + d * u_d, calculee a partir de deux
+        # resolutions (d = 0, puis d = 1 sans autre force)
+        self.event_driven = event_driven
+        self.u_F = None
+        self.u_d = None
+        # nombre d'etapes de l'experience executees par run, et increment du
+        # deplacement restant a faire avant la prochaine etape (la premiere
+        # etape commence par un increment)
+        self.iteration = 0
+        self.increment_pending = True
 
         # Resolution du systeme pour l'etat initial (d=0, F0x)
         self.solve()
 
 
-    def build_matrix(self):
-        '''Remplissage de la matrice A du systeme F = A u''' 
-        # Fonctions donnant l'indice d'un noeud adjacent au noeud i 
-        f = [self.rs.fg, self.rs.fd, self.rs.fhg, self.rs.fhd, self.rs.fbd,
-             self.rs.fbg]
+    def build_pattern(self):
+        '''Calcul, une fois pour toutes, de la structure creuse de A.
+        Les coefficients de la ligne du noeud i sont ranges dans un tableau
+        (7, 4) : pour chaque voisin k (dans l'ordre de rs.normals) les
+        coefficients A[i, k], A[i+n, k], A[i, k+n], A[i+n, k+n], puis les
+        coefficients diagonaux A[i, i], A[i, i+n], A[i+n, i], A[i+n, i+n].
+        self.positions donne pour chaque coefficient sa position dans
+        self.A.data (-1 si le coefficient n'existe pas).'''
+        rs = self.rs
+        n = rs.n
+        i = numpy.arange(n)[:, None]
+        k = rs.neighbours
+        rows = numpy.empty((n, 7, 4), dtype=int)
+        cols = numpy.empty((n, 7, 4), dtype=int)
+        ii = numpy.broadcast_to(i, k.shape)
+        rows[:, :6] = numpy.stack([ii, ii + n, ii, ii + n], axis=2)
+        cols[:, :6] = numpy.stack([k, k, k + n, k + n], axis=2)
+        rows[:, 6] = numpy.hstack([i, i, i + n, i + n])
+        cols[:, 6] = numpy.hstack([i, i + n, i, i + n])
+
+        valid = numpy.ones((n, 7, 4), dtype=bool)
+        valid[:, :6] = (k >= 0)[:, :, None]
+        # Les termes croises des ressorts horizontaux sont toujours nuls
+        valid[:, :2, 1:3] = False
+        # Premiere et derniere lignes : uy est impose, seule la diagonale
+        # A[i+n, i+n] = 1 est conservee dans la ligne i+n
+        border = rs.top | rs.bottom
+        valid[border, :6, 1] = False
+        valid[border, :6, 3] = False
+        valid[border, 6, 2] = False
+
+        rows = rows[valid]
+        cols = cols[valid]
+        # Rangement des coefficients par ligne puis par colonne (format CSR)
+        order = numpy.lexsort((cols, rows))
+        self.indices = cols[order]
+        self.indptr = numpy.concatenate(
+            ([0], numpy.cumsum(numpy.bincount(rows, minlength=2*n))))
+        self.positions = numpy.full((n, 7, 4), -1)
+        position = numpy.empty(len(order), dtype=int)
+        position[order] = numpy.arange(len(order))
+        self.positions[valid] = position
+        self.valid = valid
+
+    def matrix_values(self, nodes):
+        '''Calcul des coefficients de A sur les lignes des noeuds nodes,
+        ranges selon le motif decrit dans build_pattern.'''
+        rs = self.rs
         # Vecteurs unitaires entre deux noeuds adjacents
-        n_ = [self.ng, self.nd, self.nhg, self.nhd, self.nbd, self.nbg]
-        # Nombre de noeuds dans l'echantillon
-        n = self.rs.n
+        nx = numpy.array([n_[0] for n_ in rs.normals])
+        ny = numpy.array([n_[1] for n_ in rs.normals])
+
+        springs = rs.node_springs[nodes]
+        missing = springs < 0
+        compacted = rs.compacted[springs] & ~missing
+        top = rs.top[nodes][:, None]
+        bottom = rs.bottom[nodes][:, None]
+
+        # Raideur des ressorts, avec les parametres Rl et Ke de chaque
+        # ressort (les expressions reproduisent exactement l'ordre des
+        # operations de l'assemblage noeud par noeud)
+        Ke = rs.spring_Ke[springs]
+        Rl = rs.spring_Rl[springs]
+        alpha_top = self.rs.alpha0 * self.Kbc * Ke
+        alpha_top *= self.rs.Ka / Rl
+        alpha_bottom = self.rs.alpha0*self.Kbc*Ke*self.rs.Ka/Rl
+        alpha_comp = self.rs.alpha0*Ke*self.rs.Ka/Rl
+        alpha = numpy.where(compacted, alpha_comp, self.rs.alpha0)
+        alpha = numpy.where(bottom, numpy.where(compacted, alpha_bottom,
+                                                self.rs.alpha0 * self.Kbc),
+                            alpha)
+        alpha = numpy.where(top, numpy.where(compacted, alpha_top,
+                                             self.rs.alpha0 * self.Kbc),
+                            alpha)
+
+        values = numpy.empty((len(springs), 7, 4))
+        values[:, :6, 0] = alpha * nx**2
+        values[:, :6, 1] = alpha * ny * nx
+        values[:, :6, 2] = alpha * nx * ny
+        values[:, :6, 3] = alpha * ny**2
 
-        # Initialisation de A en tant que "List of lists matrix" 
-        self.A = scipy.sparse.lil_matrix((2*n, 2*n))
-
-        # Boucle sur tous les noeuds
-        for i in range(0, n):
-            # Premiere ligne
-            if self.rs.top_border(i):
-                # uy = -d
-                self.A[i + n, i + n] = 1
-                for j in range(0, 6):
-                    k = f[j](i)
-                    if k is not None:
-                        if not self.rs.compacted[i][k]:
-                            alpha= self.rs.alpha0 * self.Kbc
-                        else:
-                            alpha = self.rs.alpha0 * self.Kbc * self.rs.Ke
-                            alpha *= self.rs.Ka / self.rs.Rl
-                        
-                        self.A[i, k] = alpha * n_[j][0]**2
-                        self.A[i, k + n] = alpha * n_[j][0] * n_[j][1]
-
-                        self.A[i, i] += -alpha * n_[j][0]**2
-                        self.A[i, i + n] += -alpha * n_[j][1] * n_[j][0] 
-                                                
-            # Derniere ligne
-            elif self.rs.bottom_border(i):
-                # uy = 0
-                self.A[i + n, i + n] = 1
-                for j in range(0, 6):
-                    k = f[j](i)
-                    if k is not None:
-                        if not self.rs.compacted[i][k]:
-                            alpha= self.rs.alpha0 * self.Kbc
-                        else:
-                            alpha= self.rs.alpha0*self.Kbc*self.rs.Ke*self.rs.Ka/self.rs.Rl
-                        
-                        self.A[i, k] = alpha * n_[j][0]**2
-                        self.A[i, k + n] = alpha * n_[j][0] * n_[j][1]
-
-                        self.A[i, i] += -alpha * n_[j][0]**2
-                        self.A[i, i + n] += -alpha * n_[j][1] * n_[j][0]
-            # Toutes les autres lignes
-            else:
-                for j in range(0, 6):
-                    k = f[j](i)
-                    if k is not None:
-                        if not self.rs.compacted[i][k]:
-                            alpha = self.rs.alpha0
-                        else:
-                            alpha = self.rs.alpha0*self.rs.Ke*self.rs.Ka/self.rs.Rl
-                        
-                        self.A[i, k] = alpha * n_[j][0]**2
-                        self.A[i + n, k] = alpha * n_[j][1] * n_[j][0]
-                        self.A[i, k + n] = alpha * n_[j][0] * n_[j][1]
-                        self.A[i + n, k + n] = alpha * n_[j][1]**2
-                        
-                        self.A[i, i] += -alpha * n_[j][0]**2
-                        self.A[i, i + n] += -alpha * n_[j][0] * n_[j][1] 
-                        self.A[i + n, i] += -alpha * n_[j][1] * n_[j][0]
-                        self.A[i + n, i + n] += -alpha * n_[j][1]**2
-        # Convert A to Compressed Sparse Row format
-        self.A = self.A.tocsr()
+        # Termes diagonaux, sommes dans l'ordre des voisins
+        xx = numpy.where(missing, 0., -alpha * nx**2)
+        xy = numpy.where(missing, 0.,
+                         numpy.where(top | bottom, -alpha * ny * nx,
+                                     -alpha * nx * ny))
+        yx = numpy.where(missing, 0., -alpha * ny * nx)
+        yy = numpy.where(missing, 0., -alpha * ny**2)
+        values[:, 6] = 0.
+        for j in range(0, 6):
+            values[:, 6, 0] += xx[:, j]
+            values[:, 6, 1] += xy[:, j]
+            values[:, 6, 2] += yx[:, j]
+            values[:, 6, 3] += yy[:, j]
+        # uy = d/2 ou -d/2 sur la premiere et la derniere ligne
+        values[rs.top[nodes] | rs.bottom[nodes], 6, 3] = 1.
+        return values
+
+    def build_matrix(self):
+        '''Remplissage de la matrice A du systeme F = A u. La matrice est
+        assemblee a partir du motif calcule par build_pattern lors du premier
+        appel ; ensuite seuls les coefficients des noeuds relies a des
+        ressorts dont l'etat de compaction a change sont recalcules.'''
+        n = self.rs.n
+        if self.A is None:
+            self.build_pattern()
+            data = numpy.empty(len(self.indices))
+            values = self.matrix_values(numpy.arange(n))
+            data[self.positions[self.valid]] = values[self.valid]
+            self.A = scipy.sparse.csr_matrix((data, self.indices, self.indptr),
+                                             shape=(2*n, 2*n))
+        else:
+            changed = self.rs.compacted != self.compacted_A
+            nodes = numpy.unique(self.rs.springs[changed])
+            values = self.matrix_values(nodes)
+            valid = self.valid[nodes]
+            self.A.data[self.positions[nodes][valid]] = values[valid]
+        self.compacted_A = self.rs.compacted.copy()
 
     def build_F(self):
         '''Remplissage de la matrice F du systeme F = A u'''
-        f = [self.rs.fg, self.rs.fd, self.rs.fhg, self.rs.fhd, self.rs.fbd,
-             self.rs.fbg]
-        n_ = [self.ng, self.nd, self.nhg, self.nhd, self.nbd, self.nbg]
-        
-        n = self.rs.n
-        leq0 = self.rs.leq0
-        Rl = self.rs.Rl
-        
+        rs = self.rs
+        n = rs.n
+        leq0 = rs.leq0
+        nx = numpy.array([n_[0] for n_ in rs.normals])
+        ny = numpy.array([n_[1] for n_ in rs.normals])
+        border = rs.top | rs.bottom
+
         # Initialisation a 0       
-        self.F = numpy.array(2 * n * [0.])
-
-        # Boucle sur tous les noeuds
-        for i in range(0, n):
-            # Force de confinement horizontale
-            if self.rs.left_border(i):
-                self.F[i] += self.F0x
-            elif self.rs.right_border(i):
-                self.F[i] -= self.F0x
-                
-            # Premiere ligne
-            if self.rs.top_border(i):
-                alpha= self.rs.alpha0 * self.Kbc * self.rs.Ke * self.rs.Ka / Rl
-                # uy = d/2
-                self.F[i + n] = self.d / 2
-                for j in range(0,6):
-                    k = f[j](i)
-                    if (k is not None) and self.rs.compacted[i][k]:
-                       self.F[i] += -alpha * leq0 * (1 - Rl) * n_[j][0]
-                       
-            # Derniere ligne
-            elif self.rs.bottom_border(i):
-                alpha= self.rs.alpha0 * self.Kbc * self.rs.Ke * self.rs.Ka / Rl
-                # uy = d/2
-                self.F[i + n] = -self.d / 2
-                for j in range(0,6):
-                    k = f[j](i)
-                    if (k is not None) and self.rs.compacted[i][k]:
-                       self.F[i] += -alpha * leq0 * (1 - Rl) * n_[j][0]
-            else:
-                alpha = self.rs.alpha0 * self.rs.Ke * self.rs.Ka / Rl
-                for j in range(0,6):
-                    k = f[j](i)
-                    if (k is not None) and self.rs.compacted[i][k]:
-                       self.F[i]   += -alpha * leq0 * (1 - Rl) * n_[j][0]
-                       self.F[i+n] += -alpha * leq0 * (1 - Rl) * n_[j][1]
+        self.F = numpy.zeros(2 * n)
+        Fx = self.F[:n]
+        Fy = self.F[n:]
+
+        # Force de confinement horizontale
+        Fx[rs.left] += self.F0x
+        Fx[rs.right & ~rs.left] -= self.F0x
 
+        # Precontrainte des ressorts compactes, sommee dans l'ordre des
+        # voisins de chaque noeud, avec les parametres Rl et Ke de chaque
+        # ressort
+        def strip(s):
+            # noeuds s (bandes horizontales de l'echantillon)
+            node_springs = rs.node_springs[s]
+            compacted = rs.compacted[node_springs] & (node_springs >= 0)
+            Ke = rs.spring_Ke[node_springs]
+            Rl = rs.spring_Rl[node_springs]
+            alpha_border = self.rs.alpha0 * self.Kbc * Ke * self.rs.Ka / Rl
+            alpha = self.rs.alpha0 * Ke * self.rs.Ka / Rl
+            alpha = numpy.where(border[s][:, None], alpha_border, alpha)
+            f = -alpha * leq0 * (1 - Rl)
+            for j in range(0, 6):
+                Fx[s] += numpy.where(compacted[:, j], f[:, j] * nx[j], 0.)
+                Fy[s] += numpy.where(compacted[:, j] & ~border[s],
+                                     f[:, j] * ny[j], 0.)
+
+        map_strips(strip, n, self.pool)
+
+        # Premiere ligne : uy = d/2 ; derniere ligne : uy = -d/2
+        Fy[rs.top] = self.d / 2
+        Fy[rs.bottom] = -self.d / 2
 
     def vertical_force_applied(self):  
-        '''Calcul de la force verticale moyenne appliquee sur l'echantillon'''
-        Fy = 0
-        count = 0
+        '''Calcul de la force verticale moyenne appliquee sur l'echantillon.
+        Renvoie les forces verticales s'appliquant sur chaque noeud de la
+        premiere ligne et de la derniere ligne (dans l'ordre des noeuds), qui
+        sont aussi conservees dans self.Fy_top et self.Fy_bottom.'''
+        rs = self.rs
+        u = rs.u
+        n = rs.n
+
+        def boundary_force(nodes, directions):
+            '''Force verticale sur les noeuds nodes due aux ressorts de
+            directions donnees'''
+            def strip(s):
+                Fyi = numpy.zeros(len(nodes[s]))
+                for j in directions:
+                    nx, ny = rs.normals[j]
+                    k = rs.neighbours[nodes[s], j]
+                    present = k >= 0
+                    springs = rs.node_springs[nodes[s], j]
+                    compacted = rs.compacted[springs] & present
+                    du = ((u[k]-u[nodes[s]])*nx +
+                          (u[k+n]-u[nodes[s]+n])*ny)
+                    f = numpy.where(compacted,
+                                    rs.compacted_stiffness(springs) *
+                                    (du + self.rs.leq0 *
+                                     (1 - rs.spring_Rl[springs])),
+                                    self.rs.alpha0 * du)
+                    Fyi = numpy.where(present, (Fyi + f) * ny, Fyi)
+                return Fyi
+
+            return numpy.concatenate(map_strips(strip, len(nodes), self.pool))
+
+        # rangee du bas : Fy depend des ressorts hg et hd
+        self.Fy_bottom = boundary_force(numpy.flatnonzero(rs.bottom), (3, 2))
+        # rangee du haut : Fy depend des ressorts bg et bd
+        self.Fy_top = boundary_force(numpy.flatnonzero(rs.top), (4, 5))
 
-        f = [self.rs.fhd, self.rs.fhg, self.rs.fbd, self.rs.fbg]
-        n_ = [self.nhd, self.nhg, self.nbd, self.nbg]
-        u = self.rs.u
-        n = self.rs.n
-        
-        for i in range(0, self.rs.n):
-            if self.rs.bottom_border(i):
-                Fyi = 0
-                # rangee du bas : Fy depend des ressorts hg et hd 
-                for j in range(0, 2):
-                    k = f[j](i)
-                    if k is None: continue
-                    if not self.rs.compacted[i][k]:
-                        alpha = self.rs.alpha0
-                        Fyi += alpha*((u[k]-u[i])*n_[j][0] + (u[k+n]-u[i+n])*n_[j][1])
-                    else:
-                        alpha = self.rs.alpha0*self.rs.Ke*self.rs.Ka/self.rs.Rl
-                        Fyi += alpha*((u[k]-u[i])*n_[j][0] + (u[k+n]-u[i+n])*n_[j][1] +
-                                      self.rs.leq0 * (1 - self.rs.Rl))
-                    Fyi *= n_[j][1]
-                        
-                Fy += abs(Fyi)
-                count += 1
-            if self.rs.top_border(i):
-                Fyi = 0
-                # rangee du haut : Fy depend des ressorts bg et bd 
-                for j in range(2, 4):
-                    k = f[j](i)
-                    if k is None: continue
-                    if not self.rs.compacted[i][k]:
-                        alpha = self.rs.alpha0
-                        Fyi += alpha*((u[k]-u[i])*n_[j][0] + (u[k+n]-u[i+n])*n_[j][1])
-                    else:
-                        alpha = self.rs.alpha0*self.rs.Ke*self.rs.Ka/self.rs.Rl
-                        Fyi += alpha*((u[k]-u[i])*n_[j][0] + (u[k+n]-u[i+n])*n_[j][1] +
-                                      self.rs.leq0 * (1 - self.rs.Rl))
-                    Fyi *= n_[j][1]
-                    
-                Fy += abs(Fyi)
-                count += 1
         # moyenne des forces verticales s'appliquant sur tous les noeuds du haut
         # et du bas de l'echantillon
-        self.Fy = Fy / count
+        self.Fy = ((numpy.abs(self.Fy_top).sum() +
+                    numpy.abs(self.Fy_bottom).sum()) /
+                   (len(self.Fy_top) + len(self.Fy_bottom)))
+        return self.Fy_top, self.Fy_bottom
 
-    def solve(self):
-        '''Resolution du systeme matriciel self.F = self.A self.rs.u'''
-        self.build_matrix()
-        self.build_F()
+    def update_matrix(self):
+        '''A ne depend que de l'etat de compaction : elle n'est mise a jour
+        et factorisee que si l'etat de compaction des ressorts a change
+        depuis la derniere factorisation. Le solveur recoit alors, en plus de
+        la nouvelle matrice, la modification de rang faible correspondante
+        (voir low_rank_update).'''
+        if self.A is None:
+            self.build_matrix()
+            self.solver.factorize(self.A)
+        else:
+            changed = numpy.flatnonzero(self.rs.compacted != self.compacted_A)
+            if len(changed) == 0:
+                return
+            U, V = self.low_rank_update(changed)
+            self.build_matrix()
+            self.solver.update(self.A, U, V)
+        if self.event_driven:
+            self.solve_basis()
+
+    def low_rank_update(self, springs):
+        '''Renvoie deux matrices creuses U (2n x k) et V (k x 2n) telles que
+        la variation de A due au changement d'etat de compaction des k
+        ressorts springs (depuis le dernier assemblage) soit U V.
+
+        La contribution d'un ressort de raideur alpha a A est
+        -alpha (D w) w^T, avec w le vecteur tel que w^T u soit l'allongement
+        du ressort et D la matrice diagonale valant Kbc sur les lignes ux de
+        la premiere et de la derniere ligne de noeuds, 0 sur leurs lignes uy
+        (deplacement impose) et 1 ailleurs.'''
+        rs = self.rs
+        n = rs.n
+        k = len(springs)
+        alpha_comp = rs.compacted_stiffness(springs)
+        alpha_old = numpy.where(self.compacted_A[springs], alpha_comp,
+                                rs.alpha0)
+        alpha_new = numpy.where(rs.compacted[springs], alpha_comp, rs.alpha0)
+        normal = numpy.array(rs.normals)[rs.orientation[springs]]
 
-        #self.rs.u = spsolve(self.A, self.F)
-        self.rs.u = solve(self.A.todense(), self.F)
+        i = rs.springs[springs, 0]
+        j = rs.springs[springs, 1]
+        dofs = numpy.array([j, j + n, i, i + n]).T
+        w = numpy.array([normal[:, 0], normal[:, 1],
+                         -normal[:, 0], -normal[:, 1]]).T
+        scale = numpy.ones((k, 4))
+        for m, node in ((0, j), (2, i)):
+            border = rs.top[node] | rs.bottom[node]
+            scale[border, m] = self.Kbc
+            scale[border, m + 1] = 0.
+        columns = numpy.repeat(numpy.arange(k), 4)
+        U = scipy.sparse.csr_matrix(
+            ((-(alpha_new - alpha_old)[:, None] * scale * w).ravel(),
+             (dofs.ravel(), columns)), shape=(2*n, k))
+        V = scipy.sparse.csr_matrix((w.ravel(), (columns, dofs.ravel())),
+                                    shape=(k, 2*n))
+        return U, V
+
+    def solve(self, compact=True):
+        '''Resolution du systeme matriciel self.F = self.A self.rs.u, puis
+        recherche des ressorts compactes (sauf si compact est faux).'''
+        self.update_matrix()
+
+        if self.event_driven:
+            self.F = self.F_F + self.d * self.F_d
+            self.rs.u = self.u_F + self.d * self.u_d
+        else:
+            self.build_F()
+            self.rs.u = self.solver.solve(self.F, self.rs.u)
 
         self.vertical_force_applied()
-        self.rs.find_compacted()
+        if compact:
+            self.new_compacted = self.rs.find_compacted(self.Kbc,
+                                                        self.iteration, self.d,
+                                                        self.pool)
+        else:
+            self.new_compacted = numpy.zeros(0, dtype=int)
+
+    def run(self, max_iterations=None, checkpoint=None,
+            checkpoint_steps=None, checkpoint_time=None):
+        '''Generateur executant l'experience de compression : a chaque etape
+        le systeme est resolu pour le deplacement courant, puis le
+        deplacement est incremente (voir increment_d) si aucun ressort n'a
+        ete compacte. Chaque etape produit un enregistrement Step.
+        L'experience se termine quand max_comp % des ressorts sont compactes
+        ou apres max_iterations etapes ; elle peut etre poursuivie par un
+        nouvel appel a run.
+        Si un nom de fichier checkpoint est donne, un point de reprise y est
+        ecrit (voir save_checkpoint) toutes les checkpoint_steps etapes et/ou
+        toutes les checkpoint_time secondes, ainsi qu'a la fin de
+        l'experience ou de l'iteration sur le generateur (par exemple
+        lorsque l'utilisateur l'interrompt).'''
+        count = 0
+        last_steps = 0
+        last_time = time.time()
+        try:
+            while self.rs.comp_count / self.rs.nsprings * 100 < self.max_comp:
+                if max_iterations is not None and count >= max_iterations:
+                    return
+                solver_iterations = getattr(self.solver, 'iterations', None)
+                # Incrementer le deplacement si aucun ressort n'a ete
+                # compacte a l'etape precedente
+                if self.increment_pending:
+                    self.increment_d()
+                    self.increment_pending = False
+                count += 1
+                self.iteration += 1
+                self.solve()
+                self.increment_pending = len(self.new_compacted) == 0
+                if checkpoint is not None and (
+                        (checkpoint_steps is not None and
+                         count - last_steps >= checkpoint_steps) or
+                        (checkpoint_time is not None and
+                         time.time() - last_time >= checkpoint_time)):
+                    self.save_checkpoint(checkpoint)
+                    last_steps = count
+                    last_time = time.time()
+                if solver_iterations is not None:
+                    solver_iterations = (self.solver.iterations -
+                                         solver_iterations)
+                yield Step(self.iteration, self.d, self.d / self.rs.h0 * 100,
+                           self.Fy, self.rs.comp_count / self.rs.nsprings * 100,
+                           self.new_compacted, solver_iterations,
+                           getattr(self.solver, 'residual', None))
+        finally:
+            if checkpoint is not None and count > last_steps:
+                self.save_checkpoint(checkpoint)
+
+    def close(self):
+        '''Arrete les threads de calcul (workers > 1)'''
+        self.pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def parameters(self):
+        '''Renvoie le dictionnaire des parametres du constructeur (hors
+        echantillon et solveur)'''
+        return {'F0x': self.F0x, 'Kbc': self.Kbc, 'd0': self.d0,
+                'delta_d': self.delt_d, 'max_comp': self.max_comp,
+                'event_driven': self.event_driven}
+
+    def save_checkpoint(self, filename):
+        '''Ecrit un point de reprise de l'experience dans le fichier
+        filename (format npz de numpy, non compresse) : parametres de
+        l'echantillon et de l'experience, seuils de compaction, etat de
+        compaction, deplacements, deplacement applique, numero de l'etape
+        et etat du generateur aleatoire de l'echantillon. Le fichier est
+        remplace de facon atomique, un point de reprise interrompu ne
+        detruit donc pas le precedent.
+        Les matrices et leur factorisation ne sont pas sauvegardees : elles
+        ne dependent que de l'etat de compaction et sont recalculees par
+        resume.'''
+        rs = self.rs
+        header = {'sample_class': type(rs).__name__,
+                  'sample': rs.parameters(),
+                  'compression': self.parameters(),
+                  'solver': self.solver_name,
+                  'rng': rs.rng.bit_generator.state,
+                  'comp_count': rs.comp_count,
+                  'iteration': self.iteration,
+                  'increment_pending': self.increment_pending}
+        tmp = filename + '.tmp'
+        with open(tmp, 'wb') as f:
+            numpy.savez(f, header=numpy.array(json.dumps(header,
+                                                         default=json_value)),
+                        Fcr=rs.Fcr, compacted=rs.compacted, u=rs.u,
+                        d=numpy.array(self.d), Fy=numpy.array(self.Fy),
+                        Fy_top=self.Fy_top, Fy_bottom=self.Fy_bottom,
+                        new_compacted=self.new_compacted)
+        os.replace(tmp, filename)
+
+    @classmethod
+    def resume(cls, filename, solver=None, workers=1):
+        '''Recree l'experience sauvegardee dans le point de reprise filename
+        (voir save_checkpoint). Un nouvel appel a run poursuit l'experience
+        exactement comme si elle n'avait pas ete interrompue (les resultats
+        sont identiques bit a bit avec les solveurs 'dense' et 'sparse' ; le
+        solveur 'woodbury' refactorise la matrice a la reprise, les
+        resultats ne different alors que par les erreurs d'arrondi).
+        Le solveur utilise peut etre change avec le parametre solver, et le
+        nombre de threads avec workers (arretes par close).'''
+        with numpy.load(filename) as data:
+            header = json.loads(str(data['header']))
+            arrays = {name: data[name] for name in data.files}
+        sample_class = getattr(echantillon, header['sample_class'])
+        rs = sample_class(**header['sample'])
+        if solver is None:
+            solver = header['solver'] or 'sparse'
+        cpr = cls(rs, solver=solver, workers=workers, **header['compression'])
+
+        # Etat de l'echantillon
+        rs.rng.bit_generator.state = header['rng']
+        rs.Fcr = arrays['Fcr']
+        rs.compacted = arrays['compacted']
+        rs.comp_count = header['comp_count']
+        rs.u = arrays['u']
+        # Etat de l'experience ; la matrice sera assemblee et factorisee
+        # de nouveau a la prochaine resolution
+        cpr.d = float(arrays['d'])
+        cpr.Fy = float(arrays['Fy'])
+        cpr.Fy_top = arrays['Fy_top']
+        cpr.Fy_bottom = arrays['Fy_bottom']
+        cpr.new_compacted = arrays['new_compacted']
+        cpr.iteration = header['iteration']
+        cpr.increment_pending = header['increment_pending']
+        cpr.A = None
+        cpr.compacted_A = None
+        cpr.u_F = None
+        cpr.u_d = None
+        return cpr
+
+    def solve_basis(self):
+        '''Calcul des deux solutions de base du mode evenementiel : u_F est le
+        deplacement pour d = 0 (confinement F0x et ressorts compactes), u_d le
+        deplacement pour d = 1 sans aucune autre force.'''
+        d = self.d
+        self.d = 0.
+        self.build_F()
+        self.d = d
+        self.F_F = self.F.copy()
+        self.u_F = self.solver.solve(self.F_F, self.u_F)
+
+        n = self.rs.n
+        self.F_d = numpy.zeros(2 * n)
+        self.F_d[n:][self.rs.top] = 0.5
+        self.F_d[n:][self.rs.bottom] = -0.5
+        self.u_d = self.solver.solve(self.F_d, self.u_d)
+
+    def increment_d(self):
+        '''Incremente le deplacement applique lorsqu'aucun nouveau ressort n'a
+        ete compacte : de delta_d, ou en mode evenementiel jusqu'au
+        deplacement provoquant la compaction du prochain ressort.'''
+        if not self.event_driven:
+            self.d += self.delt_d
+            return
+        self.update_matrix()
+        direction = -1 if self.delt_d < 0 else 1
+        d = self.rs.next_compaction(self.u_F, self.u_d, self.d, self.Kbc,
+                                    direction, self.pool)
+        if d is None:
+            # aucun ressort ne peut plus etre compacte dans cet etat
+            self.d += self.delt_d
+        else:
+            # on depasse tres legerement le seuil pour que les erreurs
+            # d'arrondi n'empechent pas la compaction du ressort
+            self.d = d + direction * self.event_tol * max(1., abs(d))
 
 
 
 
 # Test               
 if __name__ == '__main__':
-    
+    a = RockSample(23, 15, D=0.02)
+    print("Echantillon initial :")
+    print(a)
+    b = Compression(a, delta_d = 0.005, event_driven = True)
 
-    def mainloop(*args):
-        '''Compression de l'echantillon.'''
-        iteration = 0
-        a = RockSample(23, 15, D=0.02)
-        print("Echantillon initial :")
-        print(a)
-        b = Compression(a, delta_d = -0.005)
-
-
-        dfy = DisplayFy(r,xlegend="\u03B5(%)", ylegend="Fy")
-                    
-        # Boucle principale: compression tant que max comp % des ressorts ne 
-        # sont pas compactes.
-        while b.rs.comp_count < b.max_comp / 100 * b.rs.nsprings and b.Fy < 1:
-            test_comp_count = b.rs.comp_count        
-            b.solve()
-            print(b.rs.comp_count )
-            # si pas de nouveaux ressorts compactes, incrementer la compression
-            if b.rs.comp_count == test_comp_count:
-                strain = -b.d / b.rs.h0 * 100
-                compaction_rate = b.rs.comp_count / b.rs.nsprings * 100
-                print("Iteration %5d: " % iteration)
-                print("\tTaux de compression %f" % strain)
-                print("\tTaux de compaction %f" % compaction_rate)
-                print("\tForce applique %f" % b.Fy)
-                dfy.add_point(strain, b.Fy)
-                b.d += b.delt_d
-                
-            iteration += 1
-
-            def dummy():
-                DisplayRS(b.rs, scale = 30)
-
-            if iteration % 50 == 1  or 17 < iteration < 47:
-                threading.Thread(target=dummy).start()
-                
- 
-    r=Tk()
-    Button(r,text="x",command=mainloop).pack()
-    r.mainloop()
-   
+    # Boucle principale: compression tant que max comp % des ressorts ne 
+    # sont pas compactes.
+    for step in b.run():
+        print("Iteration %5d: " % step.iteration)
+        print("\tTaux de compression %f" % step.strain)
+        print("\tTaux de compaction %f" % step.comp_rate)
+        print("\tForce applique %f" % step.Fy)
+    print(a)
@@ -16,59 +16,171 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
+import time
 import tkinter
+from math import ceil, floor, log10
+
+import numpy
+
+
+def nice_step(span, nticks=5):
+    '''Returns a round step (1, 2 or 5 times a power of ten) dividing span
+    in about nticks intervals'''
+    raw = span / nticks
+    power = 10 ** floor(log10(raw))
+    for m in (1, 2, 5, 10):
+        if m * power >= raw:
+            return m * power
+
 
 class DisplayCurve(tkinter.Toplevel):
     '''Class for plotting a 2D curve.
     Parameters are:
-    the parent window, the width and height of the window, the horizontal and
-    vertical scale in pixels per unit, the margin between the plot and the
-    window border, the legend on the x and y axis.
+    the parent window, the initial ranges of x and y, the horizontal and
+    vertical scale in pixels per unit (which give the size of the plot), the
+    margin between the plot and the window border, the legend on the x and y
+    axis, and the maximum number of redraws per second.
 
-    The add_point method plots a line from the previous point to the new one.
+    The add_point and add_points methods append one point or a batch of
+    points to the curve. The points are stored in a numpy buffer and the
+    curve is a single polyline, redrawn at most max_rate times per second:
+    it is decimated to the width of the plot (the minimum and the maximum
+    of y are kept for every column of pixels), and the axes are rescaled
+    when the points get out of the plot.
     '''
     def __init__(self, parent=None, xmax = 13, ymax = 0.5, xscale = 35,
-                 yscale = 500, margin = 20, xlegend='', ylegend=''):
+                 yscale = 500, margin = 20, xlegend='', ylegend='',
+                 max_rate = 20):
         
         tkinter.Toplevel.__init__(self, parent)
 
-        self.w = 2 * margin + xmax * xscale 
-        self.h = 2 * margin + ymax * yscale
-        self.xs = xscale
-        self.ys = yscale
-        self.b = margin
+        # room for the tick labels
+        self.b = margin + 30
+        self.w = 2 * self.b + xmax * xscale
+        self.h = 2 * self.b + ymax * yscale
+        self.xlegend = xlegend
+        self.ylegend = ylegend
+        self.xrange = [0., xmax]
+        self.yrange = [0., ymax]
 
         self.canv = tkinter.Canvas(self, width=self.w, height = self.h, bg = 'white')
         self.canv.pack()
 
-        # y-axis
-        self.canv.create_line(margin,self.h - margin, margin, margin,
-                              arrow="last")
-        self.canv.create_text(margin+5, margin, text=ylegend, anchor="w")
-        for y in range(margin, int(self.h - margin), yscale):
-            self.canv.create_line(margin - 5, self.h - y, margin + 5, self.h - y)
-        
-        # y-axis
-        self.canv.create_line(margin, self.h - margin, self.w - margin,
-                              self.h - margin, arrow="last")
-        self.canv.create_text(self.w - margin, self.h - margin - 5,
-                              text=xlegend, anchor="se")
-        for x in range(margin, self.w - margin - xscale, xscale):
-            self.canv.create_line(x, self.h - margin - 5, x, self.h - margin + 5)
+        # Points of the curve
+        self.x = numpy.empty(1024)
+        self.y = numpy.empty(1024)
+        self.count = 0
+        self.curve = None
+
+        # Redraw rate
+        self.min_interval = 1. / max_rate
+        self.last_redraw = 0.
+        self.redraw_pending = False
 
-        self.prev_x = None
-        self.prev_y = None
+        self.draw_axes()
+
+    def to_canvas(self, x, y):
+        '''Canvas coordinates of the points (x, y)'''
+        (x0, x1), (y0, y1) = self.xrange, self.yrange
+        px = self.b + (x - x0) * (self.w - 2 * self.b) / (x1 - x0)
+        py = self.h - self.b - (y - y0) * (self.h - 2 * self.b) / (y1 - y0)
+        return px, py
+
+    def draw_axes(self):
+        self.canv.delete('axes')
+        b, w, h = self.b, self.w, self.h
+        # y-axis
+        self.canv.create_line(b, h - b, b, b - 10, arrow="last", tags='axes')
+        self.canv.create_text(b + 5, b - 10, text=self.ylegend, anchor="w",
+                              tags='axes')
+        # x-axis
+        self.canv.create_line(b, h - b, w - b + 10, h - b, arrow="last",
+                              tags='axes')
+        self.canv.create_text(w - b + 10, h - b - 5, text=self.xlegend,
+                              anchor="se", tags='axes')
+        # ticks and their labels
+        for axis, (v0, v1) in enumerate((self.xrange, self.yrange)):
+            step = nice_step(v1 - v0)
+            for v in numpy.arange(ceil(v0 / step), floor(v1 / step) + 1) * step:
+                if axis == 0:
+                    x, y = self.to_canvas(v, self.yrange[0])
+                    self.canv.create_line(x, y - 5, x, y + 5, tags='axes')
+                    self.canv.create_text(x, y + 7, text="%g" % v,
+                                          anchor="n", tags='axes')
+                else:
+                    x, y = self.to_canvas(self.xrange[0], v)
+                    self.canv.create_line(x - 5, y, x + 5, y, tags='axes')
+                    self.canv.create_text(x - 7, y, text="%g" % v,
+                                          anchor="e", tags='axes')
 
-                
     def add_point(self, x, y):
-        x1 = self.b + x * self.xs
-        y1 = self.h - self.b - y * self.ys
-        if self.prev_x is not None:
-            x0 = self.b + self.prev_x * self.xs
-            y0 = self.h - self.b - self.prev_y * self.ys
-            self.canv.create_line(x0, y0, x1, y1)
-        self.prev_x = x
-        self.prev_y = y
+        self.add_points([x], [y])
+
+    def add_points(self, x, y):
+        '''Appends the points (x[i], y[i]) to the curve'''
+        x = numpy.asarray(x, dtype=float)
+        y = numpy.asarray(y, dtype=float)
+        end = self.count + len(x)
+        if end > len(self.x):
+            size = max(end, 2 * len(self.x))
+            self.x = numpy.resize(self.x, size)
+            self.y = numpy.resize(self.y, size)
+        self.x[self.count:end] = x
+        self.y[self.count:end] = y
+        self.count = end
+
+        if not self.redraw_pending:
+            self.redraw_pending = True
+            delay = self.min_interval - (time.time() - self.last_redraw)
+            self.after(max(0, int(delay * 1000)), self.redraw)
+
+    def rescale(self):
+        '''Extends the ranges of the axes to the points, returns True if they
+        changed'''
+        changed = False
+        for values, bounds in ((self.x[:self.count], self.xrange),
+                               (self.y[:self.count], self.yrange)):
+            low, high = values.min(), values.max()
+            if low >= bounds[0] and high <= bounds[1]:
+                continue
+            # new range with a round step and some room for the next points
+            span = max(high, bounds[1]) - min(low, bounds[0])
+            if low < bounds[0]:
+                low -= 0.2 * span
+            if high > bounds[1]:
+                high += 0.2 * span
+            low, high = min(low, bounds[0]), max(high, bounds[1])
+            step = nice_step(high - low)
+            bounds[0] = floor(low / step) * step
+            bounds[1] = ceil(high / step) * step
+            changed = True
+        return changed
+
+    def decimate(self):
+        '''Returns the canvas coordinates of the decimated curve: for every
+        run of consecutive points in the same column of pixels, only the
+        points of minimum and maximum y are kept.'''
+        px, py = self.to_canvas(self.x[:self.count], self.y[:self.count])
+        column = px.astype(int)
+        starts = numpy.flatnonzero(numpy.diff(column, prepend=column[0] - 1))
+        ymin = numpy.minimum.reduceat(py, starts)
+        ymax = numpy.maximum.reduceat(py, starts)
+        xs = numpy.repeat(column[starts], 2)
+        ys = numpy.array([ymin, ymax]).T.ravel()
+        return numpy.array([xs, ys]).T.ravel()
+
+    def redraw(self):
+        self.redraw_pending = False
+        self.last_redraw = time.time()
+        if self.count == 0:
+            return
+        if self.rescale():
+            self.draw_axes()
+        coords = self.decimate().tolist()
+        if self.curve is None:
+            self.curve = self.canv.create_line(*coords)
+        else:
+            self.canv.coords(self.curve, *coords)
 
 
 # Exemple : programme qui affiche un point de la fonction y = 2/x a chaque fois que
@@ -87,5 +199,3 @@ if __name__ == '__main__':
     b = tkinter.Button(Fy, text="First", command = run)
     b.pack()
     Fy.mainloop()
-    
-    
@@ -19,22 +19,24 @@
 import tkinter
 from math import sqrt
 
+import numpy
+
 class DisplayRS(tkinter.Toplevel):
     '''Class for drawing a rock sample in a separate window.
     Parameters are:
     the parent window, the rock sample, the scale (pixels per unit of distance),
     the displacement, the margin between the plot and the window border.
-    
-    The add_point method plots a line from the previous point to the new one.
+
+    The window is persistent: every spring is drawn once as a canvas line,
+    and the refresh method updates the drawing for new displacements of the
+    nodes. Only the springs whose ends moved by more than tolerance pixels
+    are moved (with a single Tcl command for all of them), and only the
+    springs whose compaction state changed get a new width.
     '''
-    nd = (1,0)
-    # In a tkinter canvas the origin is in the top left corner and the y
-    # coordinate increases downwards
-    nbd = (0.5,sqrt(3)/2)
-    nbg = (-0.5,sqrt(3)/2)
 
     def __init__(self, rs, parent=None, scale = 10, d = None,
-                 margin = 30, spring_width = 1, compacted_spring_width = 3):
+                 margin = 30, spring_width = 1, compacted_spring_width = 3,
+                 tolerance = 0.5):
         
         tkinter.Toplevel.__init__(self, parent)
 
@@ -43,6 +45,7 @@ class DisplayRS(tkinter.Toplevel):
         
         self.sw = spring_width
         self.csw = compacted_spring_width
+        self.tolerance = tolerance
 
         self.rs = rs
         
@@ -54,78 +57,99 @@ class DisplayRS(tkinter.Toplevel):
         # Canvas height
         self.h = 2 * margin + (rs.l - 1) * scale * sqrt(3.) / 2
 
-        self.ymax = (rs.l - 1) * scale * sqrt(3./2)
-
         # Canvas
         self.canv = tkinter.Canvas(self, width=self.w, height = self.h, bg = 'white')
         self.canv.pack()
 
-        self.draw()
-
         # Labels (strain and compaction rate)
-        if d is not None:
-            ltext = "\u03b5 = %.3f%%" % (self.d / self.rs.h0 * 100)
-            self.label_eps = tkinter.Label(self, text = ltext)
-            self.label_eps.pack()
-        ltext = "Compaction rate: %.3f%%" % (self.rs.comp_count /
-                                             self.rs.nsprings *100)
-        self.label_comp = tkinter.Label(self, text = ltext)
+        self.label_eps = tkinter.Label(self)
+        self.label_eps.pack()
+        self.label_comp = tkinter.Label(self)
         self.label_comp.pack()
 
-##        # Put the strain value in the window title (PROBLEME D'ENCODAGE DES
-##        # CARACTERES GRECS (epsilon) A REGLER !!!!!!!!!!!!!!!!!!!!!!!!!!!!!  
-##        if d is not None:
-##            titre = "\u03b5 = %.1f%%" % (self.d / self.rs.h0 * 100)
-##            self.title(titre)
-        self.mainloop()
-
-    def y_coord(self, i):
-        '''Returns the y coordinate of node indexed by i'''
-        y = i // self.rs.len2lines * 2 + (i % self.rs.len2lines) // self.rs.c
-        y *= sqrt(3)/2 * self.rs.leq0
-        return y
-    
-    def x_coord(self, i):
-        '''Returns the x coordinate of node indexed by i'''
-        x = (i % self.rs.len2lines)
-        # If node is on a "long" line
-        if x < self.rs.c:
-            x = x * self.rs.leq0
-        # If node is on an odd line
-        else:
-            x = (x - self.rs.c + 0.5) * self.rs.leq0
-        return x
-    
-    def draw(self):
-        '''For each node in the spring network, draw the right, the bottom-right
-        and the left spring
-        '''
-        for i in range(0, self.rs.n):
-            x0 = self.m + self.s * (self.x_coord(i) + self.rs.u[i])
-            y0 = self.m + self.s * (self.y_coord(i) + self.rs.u[i+self.rs.n]) 
-            # ressort a droite, en bas a droite, en bas a gauche
-            kd, kbd, kbg = (self.rs.fd(i), self.rs.fbd(i), self.rs.fbg(i))
-            for k in (kd, kbd, kbg):
-                if k is not None:
-                    if not self.rs.compacted[i][k]:
-                        sw = self.sw
-                    else:
-                        sw = self.csw
-                    x1 = self.m + self.s * (self.x_coord(k) + self.rs.u[k])
-                    y1 = self.m + self.s * (self.y_coord(k) + 
-                                            self.rs.u[k+self.rs.n])
-                    self.canv.create_line(x0, y0, x1, y1, width = sw)
-            
-        
+        self.draw()
 
+    def coordinates(self, u):
+        '''Returns the canvas coordinates (x0, y0, x1, y1) of every spring
+        for the displacements u'''
+        n = self.rs.n
+        x, y = self.rs.node_coordinates()
+        x = self.m + self.s * (x + u[:n])
+        y = self.m + self.s * (y + u[n:])
+        i = self.rs.springs[:, 0]
+        k = self.rs.springs[:, 1]
+        return numpy.array([x[i], y[i], x[k], y[k]]).T
 
-# Exemple : dessin d'un echantillon de taille 23x15
+    def draw(self):
+        '''Draw every spring of the network (thicker lines for compacted
+        springs)
+        '''
+        self.canv.delete('spring')
+        self.drawn = self.coordinates(self.rs.u)
+        self.compacted = self.rs.compacted.copy()
+        self.items = numpy.array([
+            self.canv.create_line(*xy, width = self.csw if c else self.sw,
+                                  tags = 'spring')
+            for xy, c in zip(self.drawn, self.compacted)])
+        self.update_labels()
+
+    def refresh(self, u=None, compacted=None, d=None):
+        '''Update the drawing for the displacements u and the compaction
+        state compacted (by default those of the rock sample) and the
+        applied displacement d'''
+        if u is None:
+            u = self.rs.u
+        if compacted is None:
+            compacted = self.rs.compacted
+        if d is not None:
+            self.d = d
+        canvas = str(self.canv)
+        commands = []
+
+        xy = self.coordinates(u)
+        moved = numpy.flatnonzero(
+            (numpy.abs(xy - self.drawn) > self.tolerance).any(axis=1))
+        self.drawn[moved] = xy[moved]
+        for s in moved:
+            commands.append("%s coords %d %.1f %.1f %.1f %.1f" %
+                            ((canvas, self.items[s]) + tuple(xy[s])))
+
+        changed = numpy.flatnonzero(compacted != self.compacted)
+        self.compacted[changed] = compacted[changed]
+        for s in changed:
+            commands.append("%s itemconfigure %d -width %g" %
+                            (canvas, self.items[s],
+                             self.csw if compacted[s] else self.sw))
+
+        if commands:
+            self.tk.eval("\n".join(commands))
+        self.update_labels()
+
+    def update_labels(self):
+        if self.d is not None:
+            self.label_eps.configure(text = "\u03b5 = %.3f%%" %
+                                     (self.d / self.rs.h0 * 100))
+        self.label_comp.configure(text = "Compaction rate: %.3f%%" %
+                                  (self.compacted.sum() /
+                                   self.rs.nsprings * 100))
+
+
+# Exemple : dessin d'un echantillon de taille 23x15, puis animation de sa
+# compression
 if __name__ == '__main__':
     from echantillon import RockSample
+    from compression import Compression
 
-    a = RockSample(23, 15)
-    
-    DisplayRS(a, d = 1)
+    a = RockSample(23, 15, D = 0.02)
+    view = DisplayRS(a, d = 0)
+    cpr = Compression(a, event_driven = True)
+    steps = cpr.run()
 
+    def animate():
+        for step in steps:
+            view.refresh(d = step.d)
+            view.after(20, animate)
+            return
 
-            
+    view.after(500, animate)
+    view.mainloop()
@@ -18,17 +18,21 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
-import random
 import numpy
 
-from math import sqrt, atan, radians, cos
+from math import sqrt, radians, cos, sin
+
+from strips import map_strips
 
 class RockSample:
     '''Un echantillon de gre est modelise par ses dimensions (nombre de lignes
     et de colonnes), le seuil de compaction de ses ressorts F0cr, son desordre
     D, la longueur d'equilibre initiale de ses ressorts leq0,  la reduction de
     la longueur d'equilibre apres compaction Rl=lnew/l0, la constante elastique
-    initiale E0 et sa variation apres compaction Ke=Enew/E0.'''
+    initiale E0 et sa variation apres compaction Ke=Enew/E0.
+    Les seuils de compaction sont tires par un generateur aleatoire
+    numpy.random.Generator initialise avec seed : deux echantillons crees
+    avec le meme seed (different de None) sont identiques.'''
 
     # Vecteurs unitaires de l'axe des ressorts (l'axe y pointe vers le bas)
     ng = (-1,0)
@@ -37,15 +41,23 @@ class RockSample:
     nhd = (0.5, -sqrt(3)/2)
     nbg = (-0.5, sqrt(3)/2)
     nbd = (0.5, sqrt(3)/2)
+    normals = (ng, nd, nhg, nhd, nbd, nbg)
+    # indices dans normals des orientations des ressorts a droite, en bas a
+    # droite et en bas a gauche d'un noeud
+    spring_directions = (1, 4, 5)
+    # indice dans normals de la direction opposee a chaque direction
+    opposite_directions = (1, 0, 4, 5, 2, 3)
     
     def __init__(self, nlines, ncols, leq0=1, Rl=0.94, A0=1, Ka=1, E0=1, Ke=1,
-                F0cr=0.03, D=0):
+                F0cr=0.03, D=0, seed=None):
         self.l = nlines
         self.c = ncols
         self.Rl = Rl
         self.Ke = Ke
         self.Ka = Ka
         self.leq0 = leq0
+        self.A0 = A0
+        self.E0 = E0
         self.alpha0 = E0 * A0 / leq0
         # Hauteur initiale
         self.h0 = (nlines - 1) * sqrt(3)/2
@@ -53,6 +65,9 @@ class RockSample:
         self.F0cr = F0cr
         # Desordre
         self.D = D
+        # Generateur aleatoire des seuils de compaction
+        self.seed = seed
+        self.rng = numpy.random.default_rng(seed)
         # nombre de noeuds sur deux lignes
         self.len2lines = 2*self.c-1
         # nombre de noeuds et de ressorts
@@ -62,14 +77,21 @@ class RockSample:
         if nlines % 2 == 1: 
             self.n += ncols 
             self.nsprings += ncols - 1
-        # matrice des seuils de compaction
+        # tables des voisins et des bords, liste des ressorts
+        self.build_topology()
+        self.build_springs()
+        # rapport Rl et variation Ke de la raideur de chaque ressort apres
+        # compaction
+        self.spring_Rl, self.spring_Ke = self.spring_properties()
+        # seuils de compaction des ressorts
         self.Fcr = self.compaction_tresholds()
-        # Initialisation de la matrice marquant la compaction des ressorts
-        self.compacted = []
-        for i in range(0, self.n):
-            self.compacted.append([False] * self.n)
+        # Initialisation du tableau marquant la compaction des ressorts
+        self.compacted = numpy.zeros(self.nsprings, dtype=bool)
         # Compteur du nombre de ressorts compactes
         self.comp_count = 0
+        # Journal des compactions (voir event_log.EventLog), None si les
+        # compactions ne sont pas enregistrees
+        self.event_log = None
         # Init du vecteur deplacement des noeuds ; les n premiers elements sont
         # les deplacements selon x, les n suivants les deplacements selon y
         self.u = numpy.array(2 * self.n * [0.])
@@ -104,23 +126,116 @@ class RockSample:
                                                            self.nsprings * 100)
         return representation
         
+    def parameters(self):
+        '''Renvoie le dictionnaire des parametres du constructeur permettant
+        de recreer l'echantillon (seed n'est conserve que s'il est entier :
+        les seuils et l'etat du generateur sont sauvegardes par ailleurs
+        dans les points de reprise, voir Compression.save_checkpoint).'''
+        return {'nlines': self.l, 'ncols': self.c, 'leq0': self.leq0,
+                'Rl': self.Rl, 'A0': self.A0, 'Ka': self.Ka, 'E0': self.E0,
+                'Ke': self.Ke, 'F0cr': self.F0cr, 'D': self.D,
+                'seed': (int(self.seed) if isinstance(self.seed,
+                                                      (int, numpy.integer))
+                         else None)}
+
+    def build_topology(self):
+        '''Construction, une fois pour toutes, des tables decrivant le reseau :
+        - neighbours[i, j] : indice du voisin du noeud i dans la direction
+          normals[j] (gauche, droite, haut gauche, haut droite, bas droite,
+          bas gauche), ou -1 s'il n'existe pas ;
+        - top, bottom, left, right : masques booleens des noeuds situes sur
+          les bords de l'echantillon.
+        Ces tables remplacent les appels aux fonctions fg, fd... et
+        top_border, bottom_border... dans les calculs.'''
+        n = self.n
+        c = self.c
+        i = numpy.arange(n)
+        # position du noeud sur un groupe de deux lignes
+        r = i % self.len2lines
+
+        self.top = i < c
+        if self.l % 2 == 1:
+            self.bottom = i >= n - c
+        else:
+            self.bottom = i > n - c
+        self.left = (r == 0) | (r == c)
+        self.right = (r == c - 1) | (r == self.len2lines - 1)
+
+        # pas de voisin a gauche (resp. a droite) sur une ligne paire
+        long_left = r == 0
+        long_right = r == c - 1
+        neighbours = numpy.array([i - 1, i + 1, i - c, i - c + 1,
+                                  i + c, i + c - 1]).T
+        missing = numpy.array([self.left, self.right,
+                               self.top | long_left, self.top | long_right,
+                               self.bottom | long_right,
+                               self.bottom | long_left]).T
+        neighbours[missing] = -1
+        self.neighbours = neighbours
+
+    def build_springs(self):
+        '''Construction de la liste des ressorts. Le ressort s relie les
+        noeuds springs[s, 0] et springs[s, 1] (springs[s, 0] < springs[s, 1])
+        et son axe a pour vecteur unitaire normals[orientation[s]], oriente
+        du premier noeud vers le second. Les ressorts sont numerotes noeud
+        par noeud, dans l'ordre : a droite, en bas a droite, en bas a gauche.
+        node_springs[i, j] est l'indice du ressort reliant le noeud i a son
+        voisin neighbours[i, j] (-1 s'il n'existe pas).'''
+        directions = list(self.spring_directions)
+        k = self.neighbours[:, directions]
+        valid = k >= 0
+        i = numpy.repeat(numpy.arange(self.n), 3).reshape(-1, 3)
+        self.springs = numpy.array([i[valid], k[valid]]).T
+        self.orientation = numpy.tile(directions, (self.n, 1))[valid]
+        # vecteurs unitaires des ressorts et ressorts horizontaux de la
+        # premiere et de la derniere ligne (soumis a la friction de la presse)
+        self.spring_normals = numpy.array(self.normals)[self.orientation]
+        self.friction = ((self.top | self.bottom)[self.springs[:, 0]] &
+                         (self.spring_normals[:, 1] == 0))
+
+        ids = numpy.full(k.shape, -1)
+        ids[valid] = numpy.arange(len(self.springs))
+        self.node_springs = numpy.full(self.neighbours.shape, -1)
+        self.node_springs[:, directions] = ids
+        # chaque ressort est aussi vu depuis son second noeud, dans la
+        # direction opposee
+        opposite = numpy.array(self.opposite_directions)
+        self.node_springs[self.springs[:, 1], opposite[self.orientation]] = \
+            numpy.arange(len(self.springs))
+        # ecart d'indice entre les deux noeuds -> direction dans normals
+        self.spring_offsets = {-1: 0, 1: 1, -self.c: 2, 1 - self.c: 3,
+                               self.c: 4, self.c - 1: 5}
+
+    def node_coordinates(self):
+        '''Renvoie les tableaux des coordonnees (x, y) de tous les noeuds de
+        l'echantillon non deforme (l'axe y pointe vers le bas).'''
+        i = numpy.arange(self.n)
+        r = i % self.len2lines
+        x = numpy.where(r < self.c, r, r - self.c + 0.5) * self.leq0
+        y = (i // self.len2lines * 2 + r // self.c) * sqrt(3) / 2 * self.leq0
+        return x, y
+
+    def spring_id(self, i, k):
+        '''Renvoie l'indice du ressort reliant les noeuds i et k (None si les
+        noeuds ne sont pas voisins).'''
+        j = self.spring_offsets.get(k - i)
+        if j is None or self.neighbours[i, j] != k:
+            return None
+        return self.node_springs[i, j]
+
+    def spring_properties(self):
+        '''Renvoie les tableaux des parametres Rl et Ke de chaque ressort
+        (les memes pour tous les ressorts d'un echantillon homogene).'''
+        return (numpy.full(self.nsprings, float(self.Rl)),
+                numpy.full(self.nsprings, float(self.Ke)))
+
     def compaction_tresholds(self):
-        '''Creation d'une matrice n*n des seuils de compaction avec un seuil
-        variant aleatoirement selon une distribution gaussienne de moyenne
-        F0cr et d'ecart type F0cr*D.
-        La matrice est symetrique car le ressort reliant les noeuds i et j
-        peut etre decrit par les couples d'indices (i,j) et (j,i).''' 
-        random.seed()
-        # Initialisation de tous les elements a 0
-        Fcr = []
-        for i in range(0, self.n):
-            Fcr.append([0.] * self.n)        
-        # Remplissage symetrique
-        for i in range(0, self.n):
-            for j in range(i, self.n):
-                Fcr[i][j] = random.gauss(self.F0cr, self.F0cr*self.D)
-                Fcr[j][i] = Fcr[i][j]                
-        return Fcr
+        '''Creation du tableau des seuils de compaction des ressorts avec un
+        seuil variant aleatoirement selon une distribution gaussienne de
+        moyenne F0cr et d'ecart type F0cr*D. Le seuil du ressort s est le
+        s-ieme tirage du generateur.'''
+        return self.F0cr + self.F0cr*self.D * self.rng.standard_normal(
+            self.nsprings)
 
     def test_index_out_of_range(self, index):
         '''Si index >= self.n, renvoie une erreur.'''
@@ -234,47 +349,133 @@ class RockSample:
         i = index % self.len2lines
         return (i == 0 or i == self.c)
 
-    def find_compacted(self, Kbc=20):
-        '''Fonction qui met a jour le nombre de noeud compactes comp_count et la
-        matrice marquant la compaction. Le parametre Kbc represente
+    def spring_displacements(self, u, springs=slice(None)):
+        '''Renvoie les composantes (x, y) du deplacement relatif u[k] - u[i]
+        des deux extremites (i, k) de chaque ressort (ou des ressorts
+        springs seulement).'''
+        i = self.springs[springs, 0]
+        k = self.springs[springs, 1]
+        n = self.n
+        return u[k] - u[i], u[k + n] - u[i + n]
+
+    def spring_vectors(self, u, springs=slice(None)):
+        '''Renvoie les composantes (x, y) des vecteurs reliant les deux
+        extremites de chaque ressort (ou des ressorts springs seulement)
+        pour le deplacement u.'''
+        dx, dy = self.spring_displacements(u, springs)
+        return (self.spring_normals[springs, 0] * self.leq0 + dx,
+                self.spring_normals[springs, 1] * self.leq0 + dy)
+
+    def compaction_stiffness(self, Kbc, springs=slice(None)):
+        '''Raideur de chaque ressort intact (ou des ressorts springs) utilisee
+        pour le critere de compaction (alpha0, multipliee par Kbc pour les
+        ressorts horizontaux de la premiere et de la derniere ligne).'''
+        return numpy.where(self.friction[springs], self.alpha0 * Kbc,
+                           self.alpha0)
+
+    def compacted_stiffness(self, springs=slice(None)):
+        '''Raideur de chaque ressort compacte (ou des ressorts springs)
+        loin des bords : alpha0 * Ke * Ka / Rl, avec les parametres Rl et Ke
+        du ressort.'''
+        return (self.alpha0 * self.spring_Ke[springs] * self.Ka /
+                self.spring_Rl[springs])
+
+    def find_compacted(self, Kbc, step=0, d=0., pool=None):
+        '''Fonction qui met a jour le nombre de noeud compactes comp_count et le
+        tableau marquant la compaction. Le parametre Kbc represente
         l'augmentation de la raideur sur les bords hauts et bas de l'echantillon
         a cause de la friction entre l'echantillon et la presse.
+        Si un journal event_log est attache a l'echantillon, chaque compaction
+        y est enregistree avec le numero de l'etape step et le deplacement
+        applique d.
+        Les ressorts sont examines par bandes horizontales en parallele si un
+        pool de threads (strips.StripPool) est donne.
+        Renvoie le tableau des indices des ressorts nouvellement compactes.
         '''
-        u = self.u
-        leq0 = self.leq0
-        n = self.n
-        
-        f = [self.fd, self.fhd, self.fhg]
-        n_ = [self.nd, self.nhd, self.nhg]
-        for i in range(0, n):
-            # Pour chaque noeud, tester 3 ressorts (a droite, en haut a droite
-            # et en haut  gauche
-            for j in range(0, 3):
-                k = f[j](i)
-                if (k is not None) and (not self.compacted[i][k]):
-                    lreal = sqrt((n_[j][0] * leq0 + u[k] - u[i])**2 +
-                                 (n_[j][1] * leq0 + u[k + n] - u[i + n])**2)
-                    
-                    if (self.top_border(i) or self.bottom_border(i)) and j==0 :
-                        # Friction sur les bords
-                        alpha = self.alpha0 * Kbc
-                    else:
-                        alpha = self.alpha0
-                    if -alpha * (lreal - leq0) > self.Fcr[i][k]:
-                        self.compacted[i][k] = True
-                        self.compacted[k][i] = True
-                        self.comp_count += 1
+        def strip(s):
+            x, y = self.spring_vectors(self.u, s)
+            lreal = numpy.sqrt(x**2 + y**2)
+            alpha = self.compaction_stiffness(Kbc, s)
+            force = -alpha * (lreal - self.leq0)
+            new = numpy.flatnonzero((force > self.Fcr[s]) & ~self.compacted[s])
+            return new + s.start, force[new]
+
+        # les bandes sont concatenees dans l'ordre : les indices sont tries
+        new, force = (numpy.concatenate(a) for a in
+                      zip(*map_strips(strip, self.nsprings, pool)))
+        self.compacted[new] = True
+        self.comp_count += len(new)
+        if self.event_log is not None and len(new) > 0:
+            self.event_log.write(step, d, new, force, self.Fcr[new])
+        return new
+
+    def next_compaction(self, u0, u1, d, Kbc, direction=1, pool=None):
+        '''Renvoie le deplacement applique pour lequel le prochain ressort
+        sera compacte, lorsque le deplacement des noeuds est une fonction
+        affine u0 + d * u1 du deplacement applique d (etat de compaction
+        fixe). La recherche se fait a partir de d dans le sens de direction
+        (1 ou -1), pour le facteur de friction Kbc de l'experience (voir
+        find_compacted). Renvoie None si aucun ressort ne peut etre compacte.
+
+        Le ressort (i, k) est compacte quand sa longueur devient inferieure
+        a L = leq0 - Fcr / alpha, soit |p + d b| < L avec
+        p = leq0 n + u0[k] - u0[i] et b = u1[k] - u1[i] : le deplacement de
+        compaction est la plus petite racine d'un polynome du second degre.
+        Les ressorts sont examines par bandes en parallele si un pool de
+        threads (strips.StripPool) est donne.
+        '''
+        # on se ramene a une recherche dans le sens des d croissants
+        s = direction
+        u1 = s * u1
+
+        def strip(springs):
+            L = (self.leq0 - self.Fcr[springs] /
+                 self.compaction_stiffness(Kbc, springs))
+            px, py = self.spring_vectors(u0, springs)
+            bx, by = self.spring_displacements(u1, springs)
+            a2 = bx**2 + by**2
+            a1 = px * bx + py * by
+            a0 = px**2 + py**2 - L**2
+            delta = a1**2 - a2 * a0
+            ok = ~self.compacted[springs] & (L > 0) & (a2 > 0) & (delta > 0)
+            # la longueur est inferieure a L entre les deux racines
+            r = (-a1[ok] - numpy.sqrt(delta[ok])) / a2[ok]
+            r = r[r > s * d]
+            return r.min() if len(r) > 0 else numpy.inf
+
+        r = min(map_strips(strip, self.nsprings, pool))
+        if r == numpy.inf:
+            return None
+        return s * r
 
 
 class StratifiedRockSample(RockSample):
     '''Echantillon stratifie.
-    Identique a un echantillon normal sauf pour la distribution des
-    seuils de compaction. L'echantillon est compose de deux types de strates
-    definies par leur epaisseur t0 et t1, leur pendage et leur seuils de
-    compaction F0cr et F1cr.'''
+    Identique a un echantillon normal sauf pour les parametres de ses
+    ressorts, qui dependent de la strate de leur premier noeud. Par defaut
+    l'echantillon est compose de deux types de strates definies par leur
+    epaisseur t0 et t1, leur pendage dip (en degres) et leur seuils de
+    compaction F0cr et F1cr.
+    Un empilement quelconque de strates est donne par layers : liste de
+    dictionnaires (un par strate, de haut en bas) contenant l'epaisseur
+    'thickness' de la strate et eventuellement son seuil de compaction moyen
+    'Fcr', son desordre 'D' et ses parametres 'Rl' et 'Ke' (les parametres
+    absents sont ceux de l'echantillon : F0cr, D, Rl et Ke). F1cr, t0 et t1
+    sont alors ignores. L'empilement se repete periodiquement dans la
+    direction perpendiculaire a la stratification, par exemple :
+
+        StratifiedRockSample(71, 31, dip = 20, layers = [
+            {'thickness': 4, 'Fcr': 0.032},
+            {'thickness': 8, 'Fcr': 0.028, 'D': 0.1},
+            {'thickness': 2, 'Fcr': 0.025, 'Rl': 0.9, 'Ke': 0.8}])
+    '''
+
+    # Parametres d'une strate
+    layer_parameters = ('thickness', 'Fcr', 'D', 'Rl', 'Ke')
 
     def __init__(self, nlines, ncols, leq0=1, Rl=0.94, A0=1, Ka=1, E0=1, Ke=1,
-                 F0cr=0.028, D=0, F1cr=0.032, dip = 0, t0 = 15, t1 = 15):
+                 F0cr=0.028, D=0, F1cr=0.032, dip = 0, t0 = 15, t1 = 15,
+                 seed=None, layers=None):
 
         self.F1cr = F1cr
         # pendage en degres
@@ -283,12 +484,38 @@ class StratifiedRockSample(RockSample):
         self.thickness0 = t0
         # epaisseur de la couche de seuil  F1cr
         self.thickness1 = t1
-        if t0 < 0 or t1 < 0:
+        if layers is None:
+            layers = [{'thickness': t0, 'Fcr': F0cr},
+                      {'thickness': t1, 'Fcr': F1cr}]
+        # parametres complets des strates
+        self.layers = []
+        for layer in layers:
+            unknown = set(layer) - set(self.layer_parameters)
+            if unknown or 'thickness' not in layer:
+                raise ValueError("A layer is defined by its thickness and "
+                                 "optionally by Fcr, D, Rl and Ke")
+            self.layers.append(dict({'Fcr': F0cr, 'D': D, 'Rl': Rl,
+                                     'Ke': Ke}, **layer))
+        thickness = numpy.array([layer['thickness'] for layer in self.layers],
+                                dtype=float)
+        if (thickness < 0).any():
             raise ValueError("Layer thickness cannot be a negative value")
+        if len(thickness) == 0 or thickness.sum() == 0:
+            raise ValueError("The total thickness of the layers must be "
+                             "positive")
+        # limites des strates (du cote des projections croissantes, voir
+        # layer_ids) sur une periode de l'empilement
+        self.boundaries = numpy.cumsum(thickness)
         # RockSample.__init__(nlines, ncols, leq0, Rl, A0, Ka, E0, Ke, F0cr, D)
-        RockSample.__init__(self, nlines, ncols, leq0, Rl, A0, Ka, E0, Ke, F0cr, D)
-
+        RockSample.__init__(self, nlines, ncols, leq0, Rl, A0, Ka, E0, Ke, F0cr, D,
+                            seed)
 
+    def parameters(self):
+        parameters = RockSample.parameters(self)
+        parameters.update({'F1cr': self.F1cr, 'dip': self.dip,
+                           't0': self.thickness0, 't1': self.thickness1,
+                           'layers': self.layers})
+        return parameters
 
     def y_coord(self, i):
         '''Returns the y coordinate of node indexed by i'''
@@ -307,57 +534,53 @@ class StratifiedRockSample(RockSample):
             x = (x - self.c + 0.5) * self.leq0
         return x
 
+    def layer_ids(self, x, y):
+        '''Renvoie le tableau des indices des strates contenant les points
+        de coordonnees (x, y) (tableaux, par exemple les noeuds ou les
+        milieux des ressorts de l'echantillon non deforme), calcules en une
+        passe.
 
-    def which_layer(self, index):
-        '''Determine dans quelle strate (0 ou 1) le noeud se trouve.'''
+        La projection orthogonale p = y cos(dip) - x sin(dip) d'un point sur
+        un axe perpendiculaire a la stratification est ramenee a une periode
+        de l'empilement : la strate j occupe les projections de l'intervalle
+        [k T + b[j-1], k T + b[j][ (b : sommes cumulees des epaisseurs,
+        T : epaisseur totale). Une strate d'epaisseur nulle ne contient donc
+        aucun point.'''
+        dip = radians(self.dip)
+        proj = (numpy.asarray(y, dtype=float) * cos(dip) -
+                numpy.asarray(x, dtype=float) * sin(dip))
+        period = self.boundaries[-1]
+        position = numpy.mod(proj, period)
+        # mod peut renvoyer period (arrondi) pour une projection negative
+        position[position >= period] = 0.
+        return numpy.searchsorted(self.boundaries, position, side='right')
+
+    def node_layers(self):
+        '''Renvoie le tableau des indices des strates de tous les noeuds'''
+        return self.layer_ids(*self.node_coordinates())
 
+    def which_layer(self, index):
+        '''Determine dans quelle strate le noeud se trouve.'''
         self.test_index_out_of_range(index)
+        return int(self.layer_ids([self.x_coord(index)],
+                                  [self.y_coord(index)])[0])
 
-        def f(x, y):
-            '''Projection orthogonale du point (x, y) sur un axe y'
-            perpendiculaire a la stratification.'''
-            if y > 0.00001 or y < -0.00001:
-                return sqrt(x**2 + y**2) * cos(radians(self.dip) + atan(x / y))
-            else:
-                return sqrt(x**2 + y**2) * cos(radians(self.dip) + radians(90))
+    def layer_values(self, name):
+        '''Renvoie le tableau du parametre name ('Fcr', 'D', 'Rl' ou 'Ke')
+        de la strate de chaque ressort.'''
+        values = numpy.array([layer[name] for layer in self.layers],
+                             dtype=float)
+        return values[self.spring_layers]
+
+    def spring_properties(self):
+        '''Parametres Rl et Ke de la strate de chaque ressort (la strate d'un
+        ressort est celle de son premier noeud).'''
+        self.spring_layers = self.node_layers()[self.springs[:, 0]]
+        return self.layer_values('Rl'), self.layer_values('Ke')
 
-        proj = f(self.x_coord(index), self.y_coord(index))
-        
-        dummy = 0
-        if proj > 0:
-            while dummy < proj:
-                dummy += self.thickness0
-                if dummy >= proj:
-                    return 0
-                dummy += self.thickness1
-                if dummy >= proj:
-                    return 1
-        elif proj < 0:
-            while dummy > proj:
-                dummy -= self.thickness1
-                if dummy < proj:
-                    return 1
-                dummy -= self.thickness0
-                if dummy < proj:
-                    return 0
-            return 0
-    
     def compaction_tresholds(self):
-        '''Matrice des seuils de compactions'''
-        random.seed()
-        # Initialisation de tous les elements a 0
-        Fcr = []
-        for i in range(0, self.n):
-            Fcr.append([0.] * self.n)
-        for i in range(0, self.n):
-            layer = self.which_layer(i)
-            for j in range(i, self.n):
-                if layer == 0:
-                    Fcr[i][j] = random.gauss(self.F0cr,self.F0cr*self.D)
-                elif layer == 1:
-                    Fcr[i][j] = random.gauss(self.F1cr,self.F1cr*self.D)
-                Fcr[j][i] = Fcr[i][j]
-        return Fcr
-
-
- 
+        '''Tableau des seuils de compaction des ressorts. Le seuil moyen et le
+        desordre d'un ressort sont ceux de la strate de son premier noeud.'''
+        Fcr = self.layer_values('Fcr')
+        return Fcr + Fcr*self.layer_values('D') * self.rng.standard_normal(
+            self.nsprings)
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+#
+# Monte Carlo ensemble of compression experiments: the same experiment is
+# run on many realizations of a rock sample (different compaction threshold
+# draws), distributed over a pool of worker processes.
+
+import os
+import time
+import traceback
+import collections
+import multiprocessing
+import multiprocessing.connection
+
+import numpy
+
+from echantillon import RockSample
+from compression import Compression
+
+
+def simulate(sample_class, sample_args, compression_args, seed,
+             max_iterations=None):
+    '''Creates a rock sample with the given seed and returns a generator over
+    the records (compression.Step) of its compression experiment.'''
+    rs = sample_class(seed=seed, **sample_args)
+    with Compression(rs, **compression_args) as cpr:
+        yield from cpr.run(max_iterations)
+
+
+def _worker(conn, sample_class, sample_args, compression_args,
+            max_iterations, batch_interval):
+    '''Worker process: runs the realizations received from conn until it
+    receives None, and sends their records back in batches.'''
+    while True:
+        task = conn.recv()
+        if task is None:
+            return
+        realization, seed = task
+        try:
+            batch = []
+            last_send = time.time()
+            for step in simulate(sample_class, sample_args, compression_args,
+                                 seed, max_iterations):
+                batch.append(step)
+                if time.time() - last_send > batch_interval:
+                    conn.send(('steps', batch))
+                    batch = []
+                    last_send = time.time()
+            conn.send(('steps', batch))
+            conn.send(('done', None))
+        except Exception:
+            conn.send(('error', traceback.format_exc()))
+
+
+class Worker:
+    '''A worker process of an ensemble, connected to the parent process by
+    its own pipe, and the realization it is running.'''
+
+    def __init__(self, ctx, args):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker, args=(child_conn,) + args,
+                                   daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.realization = None
+
+
+class Ensemble:
+    '''Ensemble of nrealizations compression experiments run in parallel.
+
+    Every realization is created by sample_class(seed=..., **sample_args)
+    and compressed by Compression(rs, **compression_args). The seeds are
+    spawned from a numpy SeedSequence initialized with seed, so that
+    realization i always gets the same thresholds for a given seed,
+    whatever the number of processes and the order of execution.
+
+    The run method is a generator yielding (realization, step) pairs as
+    soon as the workers produce them (the steps of different realizations
+    are interleaved). A realization that raises an exception, or whose
+    worker process dies, is recorded in the failed dictionary (realization
+    -> error message) and the dead worker is replaced: the other
+    realizations are not affected.
+    '''
+
+    def __init__(self, nrealizations, sample_class=RockSample,
+                 sample_args=None, compression_args=None, seed=None,
+                 processes=None, max_iterations=None, batch_interval=0.1):
+        self.nrealizations = nrealizations
+        self.sample_class = sample_class
+        self.sample_args = sample_args or {}
+        self.compression_args = compression_args or {}
+        self.seed_sequence = numpy.random.SeedSequence(seed)
+        self.seeds = self.seed_sequence.spawn(nrealizations)
+        self.processes = processes or os.cpu_count()
+        self.max_iterations = max_iterations
+        self.batch_interval = batch_interval
+        self.completed = set()
+        self.failed = {}
+
+    def run(self):
+        ctx = multiprocessing.get_context()
+        args = (self.sample_class, self.sample_args, self.compression_args,
+                self.max_iterations, self.batch_interval)
+        pending = collections.deque(range(self.nrealizations))
+
+        def assign(worker):
+            # Sends the next realization to the worker, or tells it to stop
+            if pending:
+                worker.realization = pending.popleft()
+                worker.conn.send((worker.realization,
+                                  self.seeds[worker.realization]))
+            else:
+                worker.realization = None
+                worker.conn.send(None)
+
+        workers = [Worker(ctx, args)
+                   for i in range(min(self.processes, self.nrealizations))]
+        for worker in workers:
+            assign(worker)
+        try:
+            while any(worker.realization is not None for worker in workers):
+                active = [worker for worker in workers
+                          if worker.realization is not None]
+                ready = multiprocessing.connection.wait(
+                    [worker.conn for worker in active] +
+                    [worker.process.sentinel for worker in active])
+                for i, worker in enumerate(workers):
+                    if worker.realization is None:
+                        continue
+                    if (worker.conn not in ready and
+                        worker.process.sentinel not in ready):
+                        continue
+                    # The records sent by a worker before it died are read
+                    # before its death is noticed
+                    kind = 'died'
+                    if worker.conn.poll():
+                        try:
+                            kind, payload = worker.conn.recv()
+                        except EOFError:
+                            pass
+                    realization = worker.realization
+                    if kind == 'steps':
+                        for step in payload:
+                            yield realization, step
+                    elif kind == 'done':
+                        self.completed.add(realization)
+                        assign(worker)
+                    elif kind == 'error':
+                        self.failed[realization] = payload
+                        assign(worker)
+                    else:
+                        worker.process.join()
+                        self.failed[realization] = (
+                            "Worker process %d died (exit code %s)" %
+                            (worker.process.pid, worker.process.exitcode))
+                        workers[i] = Worker(ctx, args)
+                        assign(workers[i])
+        finally:
+            for worker in workers:
+                worker.conn.close()
+                worker.process.join(timeout=1)
+                if worker.process.is_alive():
+                    worker.process.terminate()
+
+
+# Example: mean stress-strain curve of 8 realizations of a small sample
+if __name__ == '__main__':
+    ensemble = Ensemble(8, RockSample, dict(nlines = 23, ncols = 15, D = 0.05),
+                        dict(event_driven = True), seed = 1)
+    curves = {}
+    start = time.time()
+    for realization, step in ensemble.run():
+        curves.setdefault(realization, []).append((step.strain, step.Fy))
+    print("%d realizations in %.1f s, %d failed" %
+          (len(ensemble.completed), time.time() - start, len(ensemble.failed)))
+    # Mean vertical force at a few strain values
+    for strain in (2, 4, 6, 8):
+        Fy = [numpy.interp(strain, *numpy.array(curve).T)
+              for curve in curves.values()]
+        print("strain %d %%: Fy = %f +/- %f" % (strain, numpy.mean(Fy),
+                                                  numpy.std(Fy)))
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+#
+# Compaction event log: instead of snapshots of the whole sample, every
+# compaction is recorded as one fixed-size binary record (step, applied
+# displacement, spring index, force at failure, threshold) appended to a
+# file by RockSample.find_compacted. The state of the sample at any step is
+# rebuilt from the log and from the initial sample.
+
+import os
+
+import numpy
+
+# Record of a compaction in the log
+EVENT_DTYPE = numpy.dtype([('step', '<i8'), ('d', '<f8'), ('spring', '<i8'),
+                           ('force', '<f8'), ('threshold', '<f8')])
+
+
+class EventLog:
+    '''Append-only log of the compactions, stored in the file filename.
+    The log is attached to a sample to record its compactions:
+
+        rs.event_log = EventLog('run.events')
+
+    The existing records of the file are kept (a resumed experiment goes on
+    writing in the same log, see truncate).'''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, 'ab')
+
+    def write(self, step, d, springs, force, threshold):
+        '''Appends the compaction of the springs at the given step and
+        applied displacement d'''
+        events = numpy.empty(len(springs), EVENT_DTYPE)
+        events['step'] = step
+        events['d'] = d
+        events['spring'] = springs
+        events['force'] = force
+        events['threshold'] = threshold
+        self.file.write(events.tobytes())
+        self.file.flush()
+
+    def truncate(self, step):
+        '''Removes the events recorded after the given step (e.g. the events
+        written after the checkpoint from which an experiment is resumed)'''
+        self.file.flush()
+        events = read_events(self.filename)
+        keep = numpy.searchsorted(events['step'], step, side='right')
+        self.file.truncate(keep * EVENT_DTYPE.itemsize)
+
+    def close(self):
+        self.file.close()
+
+
+def read_events(filename):
+    '''Returns the events of a log as a memory mapped record array'''
+    if os.path.getsize(filename) == 0:
+        return numpy.zeros(0, EVENT_DTYPE)
+    return numpy.memmap(filename, EVENT_DTYPE, 'r')
+
+
+class Replay:
+    '''Replays a compression experiment from its log. cpr is a Compression
+    of the initial sample (same parameters and thresholds as the recorded
+    experiment, e.g. the same seed), whose state is modified by state and
+    displacement.'''
+
+    def __init__(self, filename, cpr):
+        self.events = read_events(filename)
+        self.cpr = cpr
+
+    def __len__(self):
+        return len(self.events)
+
+    def steps(self):
+        '''Returns the steps at which springs were compacted'''
+        return numpy.unique(self.events['step'])
+
+    def state(self, step):
+        '''Sets the compaction state of the sample to its state at the end
+        of the given step, and returns the compacted array'''
+        rs = self.cpr.rs
+        end = numpy.searchsorted(self.events['step'], step, side='right')
+        rs.compacted = numpy.zeros(rs.nsprings, dtype=bool)
+        rs.compacted[self.events['spring'][:end]] = True
+        rs.comp_count = int(rs.compacted.sum())
+        return rs.compacted
+
+    def displacement(self, step, d=None):
+        '''Computes (with one solve) and returns the displacements rs.u of
+        the given step: the applied displacement is d, or by default the
+        displacement at which the springs of the step were compacted, and
+        the springs compacted before the step are compacted.'''
+        if d is None:
+            events = self.events[self.events['step'] == step]
+            if len(events) == 0:
+                raise ValueError("No compaction at step %d, the applied "
+                                 "displacement d must be given" % step)
+            d = events['d'][0]
+        self.state(step - 1)
+        self.cpr.d = d
+        self.cpr.solve(compact=False)
+        return self.cpr.rs.u
+
+
+# Example: record the compactions of a small sample, then display the
+# compaction state of the sample at the step of its 100th compaction
+if __name__ == '__main__':
+    from echantillon import RockSample
+    from compression import Compression
+
+    rs = RockSample(23, 15, D = 0.02, seed = 1)
+    rs.event_log = EventLog('example.events')
+    cpr = Compression(rs, event_driven = True)
+    for step in cpr.run():
+        pass
+    rs.event_log.close()
+
+    replay = Replay('example.events',
+                    Compression(RockSample(23, 15, D = 0.02, seed = 1)))
+    step = replay.events['step'][99]
+    replay.state(step)
+    print("Step %d: %d springs compacted" % (step, replay.cpr.rs.comp_count))
@@ -19,7 +19,7 @@
 
 import tkinter
 import threading
-import time
+import queue
 from labelentry import LabelEntry
 from display_curve import DisplayCurve
 from display_rock_sample import DisplayRS
@@ -33,6 +33,13 @@ class ParamGUI(tkinter.Tk):
     def __init__(self, parent = None):
         tkinter.Tk.__init__(self,parent)
         self.parent = parent
+        # fenetre d'affichage de l'echantillon, thread de calcul, demande
+        # d'arret et abandon de l'affichage (fenetres fermees : la file des
+        # resultats n'est plus videe)
+        self.view = None
+        self.worker = None
+        self.stopped = threading.Event()
+        self.closed = threading.Event()
 
         # layout manager:
         self.grid()
@@ -143,8 +150,16 @@ class ParamGUI(tkinter.Tk):
         self.delt_d.doc += " compression (ideally no more than one spring "
         self.delt_d.doc += "should be compacted after each increment) but will "
         self.delt_d.doc += "also make the computation be more time-consuming."
+        self.delt_d.doc += " In event-driven mode the displacement jumps "
+        self.delt_d.doc += "directly to the next compaction and only the sign "
+        self.delt_d.doc += "of \u0394d is used."
         self.delt_d.grid(column=0, row=4)
 
+        self.event_driven = tkinter.BooleanVar()
+        event_check = tkinter.Checkbutton(comp_frame, text = "Event-driven",
+                                          variable = self.event_driven)
+        event_check.grid(column=0, row=6)
+
         self.max_comp = LabelEntry(comp_frame, label_text = "Max compaction(%)",
                                    val_type = float, default_val = 40.,
                                    min_val = 0, max_val = 99)
@@ -153,7 +168,7 @@ class ParamGUI(tkinter.Tk):
         self.max_comp.grid(column=0, row=5)
 
         # Display parameters:
-        # delta comp
+        # refresh
         # scale
         # comp_width
         
@@ -164,11 +179,12 @@ class ParamGUI(tkinter.Tk):
                                    font = "Helvetica 14 bold", fg = '#009')
         comp_label.grid(column=0, row=0, sticky='N')       
 
-        self.delta_comp = LabelEntry(disp_frame, label_text = "\u0394 comp(%)",
-                                     val_type = float, default_val = 3.)
-        self.delta_comp.doc = "Percentage of springs to be compacted between "
-        self.delta_comp.doc += "two displays."
-        self.delta_comp.grid(column=0, row=1)
+        self.refresh = LabelEntry(disp_frame, label_text = "Refresh (ms)",
+                                  val_type = int, default_val = 100,
+                                  min_val = 1)
+        self.refresh.doc = "Minimum time between two refreshes of the "
+        self.refresh.doc += "drawing of the rock sample."
+        self.refresh.grid(column=0, row=1)
 
         self.scale = LabelEntry(disp_frame, label_text = "Scale",
                                 val_type = int, default_val = 10)
@@ -192,12 +208,19 @@ class ParamGUI(tkinter.Tk):
         stop_button.grid(column=1, row=2) 
 
     def stop(self):
-        self.stopped = True
+        self.stopped.set()
         
 
     def run(self):
-        '''Fonction executee quand l'utilisateur clique sur "Run".'''
-        self.stopped = False
+        '''Fonction executee quand l'utilisateur clique sur "Run".
+        L'experience est executee par un thread de calcul (simulate) qui
+        transmet ses resultats a l'interface par une file bornee ; la boucle
+        Tk vide la file (poll) au plus une fois par periode de
+        rafraichissement, le calcul n'attend donc jamais l'affichage.'''
+        if self.worker is not None and self.worker.is_alive():
+            return
+        self.stopped.clear()
+        self.closed.clear()
         # Creation de l'echantillon en testant la validite des parametres
         # fournis par l'utilisateur
         try:
@@ -211,63 +234,92 @@ class ParamGUI(tkinter.Tk):
 
             cpr = Compression(rs, self.F0x.get_val(), self.Kbc.get_val(),
                               self.d0.get_val(), self.delt_d.get_val(),
-                              self.max_comp.get_val())
-            delta_comp_rate = self.delta_comp.get_val()
+                              self.max_comp.get_val(),
+                              event_driven = self.event_driven.get())
+            self.refresh_ms = self.refresh.get_val()
         except:
             # si une erreur dans les parametres est detectee, soulever
             # l'erreur pour interrompre le programme
             raise
 
-        def draw_sample():
-            "fonction d'affichage de l'echantillon"
-            DisplayRS(rs, scale = self.scale.get_val(), d = cpr.d)
-
-        iteration = 0
-        dFy = DisplayCurve(parent=self, xlegend="\u03B5(%)", ylegend="Fy",
-                           yscale = 10000, ymax = 0.05)
-  
-        cpr.d += cpr.delt_d
-        strain = cpr.d / rs.h0 * 100
-        comp_rate = rs.comp_count / rs.nsprings * 100
-        comp_rate_next_display = 0
-
-        first_compacted_displayed = False
-
-        # Commencer la compression
-        while comp_rate < cpr.max_comp:
-            if self.stopped:
+        # Une seule fenetre d'affichage de l'echantillon, mise a jour au
+        # cours de la compression
+        if self.view is not None:
+            self.view.destroy()
+        self.view = DisplayRS(rs, parent = self, scale = self.scale.get_val(),
+                              d = cpr.d,
+                              compacted_spring_width = self.comp_width.get_val())
+
+        self.dFy = DisplayCurve(parent=self, xlegend="\u03B5(%)", ylegend="Fy",
+                                yscale = 10000, ymax = 0.05)
+
+        self.updates = queue.Queue(maxsize = 2)
+        self.worker = threading.Thread(target = self.simulate, args = (cpr,),
+                                       daemon = True)
+        self.worker.start()
+        self.after(self.refresh_ms, self.poll)
+
+    def simulate(self, cpr):
+        '''Boucle de l'experience, executee par le thread de calcul (aucun
+        appel a Tk). Les points de la courbe sont accumules et envoyes avec
+        l'etat de l'echantillon des que la file n'est pas pleine : les
+        etats intermediaires sont alors perdus, pas les points.'''
+        rs = cpr.rs
+        points = []
+        for step in cpr.run():
+            points.append((step.strain, step.Fy))
+            if not self.updates.full():
+                self.updates.put_nowait((points, step.d, rs.u.copy(),
+                                         rs.compacted.copy(), False))
+                points = []
+
+            print("\nIteration %5d: " % step.iteration)
+            print("\tCompaction rate:", step.comp_rate)
+            print("\tStrain: %f" % step.strain)
+            if self.stopped.is_set():
                 print("Stopped.")
+                break
+        # le dernier etat est toujours transmis, sauf si l'affichage a ete
+        # abandonne
+        last = (points, cpr.d, rs.u.copy(), rs.compacted.copy(), True)
+        while not self.closed.is_set():
+            try:
+                self.updates.put(last, timeout = 0.1)
+                break
+            except queue.Full:
+                pass
+
+    def poll(self):
+        '''Vide la file des resultats du thread de calcul et met a jour
+        l'affichage avec le dernier etat recu (appele par la boucle Tk).
+        Les fenetres fermees par l'utilisateur ne sont plus mises a jour ;
+        si elles le sont toutes, l'experience est arretee.'''
+        view = self.view.winfo_exists()
+        curve = self.dFy.winfo_exists()
+        if not view and not curve:
+            self.closed.set()
+            self.stopped.set()
+            return
+        last = None
+        points = []
+        while True:
+            try:
+                update = self.updates.get_nowait()
+            except queue.Empty:
+                break
+            points += update[0]
+            last = update
+        if points and curve:
+            self.dFy.add_points(*zip(*points))
+        if last is not None:
+            points, d, u, compacted, done = last
+            if view:
+                self.view.refresh(u, compacted, d)
+            if done:
+                if not self.stopped.is_set():
+                    print("Done.")
                 return
-            iteration += 1
-
-            cpr.solve()
-
-            test_comp_count = rs.comp_count
-            comp_rate = rs.comp_count / rs.nsprings * 100
-
-            # Affichage
-            dFy.add_point(strain, cpr.Fy)
-            if not first_compacted_displayed and comp_rate > 0.:
-                threading.Thread(target=draw_sample).start()
-                first_compacted_displayed = True
-                time.sleep(2)
-            if comp_rate >= comp_rate_next_display:
-                threading.Thread(target=draw_sample).start()
-                comp_rate_next_display += delta_comp_rate
-                time.sleep(2)
-
-            print("\nIteration %5d: " % iteration)
-            print("\tCompaction rate:", comp_rate)
-
-            # Incrementer le deplacement si aucun ressort n'a ete compacte
-            if cpr.rs.comp_count == test_comp_count:
-                cpr.d += cpr.delt_d
-                strain = cpr.d / rs.h0 * 100
-                print("\tStrain: %f" % strain)
-
-        threading.Thread(target=draw_sample).start()
-        time.sleep(2)
-        print("Done.")
+        self.after(self.refresh_ms, self.poll)
                 
        
 if __name__ == '__main__':
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+#
+# Offscreen drawing of the rock sample: the deformed spring network is
+# rasterized into a numpy RGB image (same layout as DisplayRS: thin lines
+# for the intact springs, thick lines for the compacted ones, optionally
+# coloured by a value per spring) which can be written to a PNG file,
+# without tkinter. Whole trajectories (see trajectory.py) are rendered in
+# parallel, one PNG file per frame.
+
+import os
+import zlib
+import struct
+import concurrent.futures
+from math import sqrt
+
+import numpy
+
+# Colours of the lines (RGB) and of the colour scale used for the values
+# (from blue for vmin to red for vmax)
+BLACK = (0, 0, 0)
+WHITE = (255, 255, 255)
+COLOUR_SCALE = numpy.array([(0, 0, 255), (0, 255, 255), (0, 255, 0),
+                            (255, 255, 0), (255, 0, 0)], dtype=float)
+
+
+def image_size(rs, scale=10, margin=30):
+    '''Returns the (width, height) in pixels of the image of rs'''
+    return (int(round(2 * margin + (rs.c - 1) * scale)),
+            int(round(2 * margin + (rs.l - 1) * scale * sqrt(3) / 2)))
+
+
+def colours(values, vmin=0., vmax=1.):
+    '''Maps the values onto the colour scale, returns an (n, 3) array'''
+    t = numpy.clip((numpy.asarray(values, dtype=float) - vmin) /
+                   (vmax - vmin), 0., 1.) * (len(COLOUR_SCALE) - 1)
+    j = numpy.minimum(t.astype(int), len(COLOUR_SCALE) - 2)
+    f = (t - j)[:, None]
+    return ((1 - f) * COLOUR_SCALE[j] + f * COLOUR_SCALE[j + 1]).astype(
+        numpy.uint8)
+
+
+def compaction_ratio(rs, Kbc, u=None):
+    '''Returns the ratio of the compressive force of every spring to its
+    compaction threshold (1 at compaction, see RockSample.find_compacted),
+    Kbc being the friction factor of the experiment (Compression.Kbc)'''
+    if u is None:
+        u = rs.u
+    x, y = rs.spring_vectors(u)
+    force = -rs.compaction_stiffness(Kbc) * (numpy.sqrt(x**2 + y**2) - rs.leq0)
+    return force / rs.Fcr
+
+
+def draw_lines(image, x0, y0, x1, y1, width, colour):
+    '''Draws the segments (x0, y0) - (x1, y1) (arrays of pixel coordinates)
+    with the given width, in one pass for all the segments: every segment
+    is sampled at (at least) one point per pixel of its length and a width x
+    width square of pixels is painted around every point. colour is one
+    colour or one colour per segment.'''
+    if len(x0) == 0:
+        return
+    h, w = image.shape[:2]
+    dx = x1 - x0
+    dy = y1 - y0
+    nsamples = max(2, int(numpy.ceil(numpy.hypot(dx, dy).max())) + 1)
+    t = numpy.linspace(0., 1., nsamples)
+    px = numpy.rint(x0[:, None] + dx[:, None] * t).astype(numpy.intp)
+    py = numpy.rint(y0[:, None] + dy[:, None] * t).astype(numpy.intp)
+    colour = numpy.asarray(colour, dtype=numpy.uint8)
+    if colour.ndim == 2:
+        colour = numpy.broadcast_to(colour[:, None, :],
+                                    px.shape + (3,)).reshape(-1, 3)
+    pixels = image.reshape(-1, 3)
+    offsets = range(-(width // 2), width - width // 2)
+    for ox in offsets:
+        for oy in offsets:
+            X = (px + ox).ravel()
+            Y = (py + oy).ravel()
+            inside = (X >= 0) & (X < w) & (Y >= 0) & (Y < h)
+            pixels[Y[inside] * w + X[inside]] = (
+                colour if colour.ndim == 1 else colour[inside])
+
+
+def render(rs, u=None, compacted=None, scale=10, margin=30, spring_width=1,
+           compacted_spring_width=3, values=None, vmin=0., vmax=1.):
+    '''Returns the image (height x width x 3 array of uint8) of the sample
+    rs for the displacements u and the compaction state compacted (by
+    default, the current state of rs). If values (one per spring, e.g.
+    compaction_ratio(rs, cpr.Kbc)) is given, the springs are coloured from
+    blue (vmin) to red (vmax), otherwise they are black.'''
+    if u is None:
+        u = rs.u
+    if compacted is None:
+        compacted = rs.compacted
+    width, height = image_size(rs, scale, margin)
+    image = numpy.full((height, width, 3), 255, dtype=numpy.uint8)
+
+    x, y = rs.node_coordinates()
+    x = margin + scale * (x + u[:rs.n])
+    y = margin + scale * (y + u[rs.n:])
+    i = rs.springs[:, 0]
+    k = rs.springs[:, 1]
+    colour = BLACK if values is None else colours(values, vmin, vmax)
+    # the compacted springs are drawn over the intact ones
+    for springs, sw in ((~compacted, spring_width),
+                        (compacted, compacted_spring_width)):
+        c = colour if values is None else colour[springs]
+        draw_lines(image, x[i[springs]], y[i[springs]], x[k[springs]],
+                   y[k[springs]], sw, c)
+    return image
+
+
+def write_png(filename, image):
+    '''Writes an RGB image (height x width x 3 array of uint8) to a PNG
+    file'''
+    height, width = image.shape[:2]
+
+    def chunk(kind, data):
+        return (struct.pack('>I', len(data)) + kind + data +
+                struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+
+    # each line of pixels is preceded by its filter type (0: none)
+    raw = numpy.zeros((height, 1 + 3 * width), dtype=numpy.uint8)
+    raw[:, 1:] = image.reshape(height, -1)
+    with open(filename, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2,
+                                           0, 0, 0)))
+        f.write(chunk(b'IDAT', zlib.compress(raw.tobytes(), 6)))
+        f.write(chunk(b'IEND', b''))
+
+
+# State of the processes rendering a trajectory
+_frames = None
+
+
+def _init_frames(rs, path, events, options):
+    global _frames
+    from trajectory import Trajectory
+    from event_log import read_events
+    _frames = (rs, Trajectory(path),
+               None if events is None else read_events(events), options)
+
+
+def _render_frame(index, filename):
+    rs, trajectory, events, options = _frames
+    compacted = numpy.zeros(rs.nsprings, dtype=bool)
+    if events is not None:
+        end = numpy.searchsorted(events['step'],
+                                 trajectory.steps['iteration'][index],
+                                 side='right')
+        compacted[events['spring'][:end]] = True
+    write_png(filename, render(rs, trajectory.u[index], compacted,
+                               **options))
+    return filename
+
+
+def render_trajectory(rs, path, directory, events=None, processes=None,
+                      **options):
+    '''Renders every step of the trajectory path (see trajectory.py) of the
+    sample rs to the files frame_00000.png, frame_00001.png... of directory,
+    with a pool of processes. The compaction state of every frame is read
+    from the event log events (see event_log.py) if it is given. The other
+    options are passed to render. Returns the list of the files.'''
+    from trajectory import Trajectory
+    os.makedirs(directory, exist_ok=True)
+    count = len(Trajectory(path))
+    filenames = [os.path.join(directory, 'frame_%05d.png' % index)
+                 for index in range(count)]
+    # the sample is sent once to every process, not with every frame
+    event_log = rs.event_log
+    rs.event_log = None
+    try:
+        with concurrent.futures.ProcessPoolExecutor(
+                processes, initializer=_init_frames,
+                initargs=(rs, path, events, options)) as pool:
+            list(pool.map(_render_frame, range(count), filenames,
+                          chunksize=max(1, count // (4 * (processes or
+                                                          os.cpu_count())))))
+    finally:
+        rs.event_log = event_log
+    return filenames
+
+
+# Example: image of a sample compressed up to 20 % of compacted springs
+if __name__ == '__main__':
+    import time
+    from echantillon import RockSample
+    from compression import Compression
+
+    rs = RockSample(23, 15, D = 0.02, seed = 1)
+    cpr = Compression(rs, max_comp = 20, event_driven = True)
+    for step in cpr.run():
+        pass
+    write_png('sample.png', render(rs,
+                                   values = compaction_ratio(rs, cpr.Kbc),
+                                   vmin = 0.5, vmax = 1.))
+
+    rs = RockSample(183, 183)
+    start = time.time()
+    render(rs)
+    print("%d springs rendered in %.3f s" % (rs.nsprings, time.time() - start))
@@ -0,0 +1,489 @@
+#!/usr/bin/env python3
+#
+# Linear solvers for the system F = A u of a compression experiment.
+#
+# A solver is used in two stages: factorize(A) is called for the first
+# matrix and solve(F, x0) is called for every right-hand side as long as the
+# matrix stays the same (x0 is the previous solution for this right-hand
+# side, or None; it is only used by the iterative solvers as initial
+# guess). When springs are compacted, update(A, U, V) is called with the new
+# matrix A and the low-rank change U V of the matrix (see
+# Compression.low_rank_update); by default the new matrix is simply
+# factorized again.
+
+from math import sqrt
+
+import numpy
+import scipy.linalg
+import scipy.sparse
+import scipy.sparse.linalg
+
+try:
+    from sksparse import cholmod
+except ImportError:
+    cholmod = None
+
+
+class DenseSolver:
+    '''Reference solver: A is converted into a dense matrix and the system is
+    solved with numpy.linalg.solve. Its cost is O(n^3) per solve, so it is
+    only meant to validate the other solvers on small samples. As in
+    SparseLUSolver, the horizontal translation is fixed by ux[0] = 0.'''
+
+    def factorize(self, A):
+        self.A = pin(A).toarray()
+
+    def update(self, A, U, V):
+        self.factorize(A)
+
+    def solve(self, F, x0=None):
+        F = F.copy()
+        F[0] = 0.
+        return numpy.linalg.solve(self.A, F)
+
+
+class SparseLUSolver:
+    '''Sparse direct solver. A is kept in sparse format and factorized once
+    with SuperLU; the factorization is reused for every right-hand side
+    until the matrix changes.
+
+    The spring network is free to move horizontally as a whole, which makes
+    A singular (the system is consistent but the horizontal translation is
+    undetermined). The equation of the first degree of freedom is redundant
+    and is replaced by ux[0] = 0 before the factorization.
+    '''
+
+    def __init__(self, permc_spec='COLAMD'):
+        self.permc_spec = permc_spec
+        self.lu = None
+
+    def factorize(self, A):
+        self.lu = scipy.sparse.linalg.splu(pin(A).tocsc(),
+                                           permc_spec=self.permc_spec)
+
+    def update(self, A, U, V):
+        self.factorize(A)
+
+    def solve(self, F, x0=None):
+        F = F.copy()
+        F[0] = 0.
+        return self.lu.solve(F)
+
+
+class WoodburySolver(SparseLUSolver):
+    '''Incremental sparse direct solver. The factorization of a reference
+    matrix A0 is kept and the compactions that happened since are taken into
+    account with the Sherman-Morrison-Woodbury formula:
+    (A0 + U V)^-1 = A0^-1 - Z (I + V Z)^-1 V A0^-1, with Z = A0^-1 U.
+    Each compacted spring adds one column to U (one back-substitution), so
+    the cost of an update is proportional to the number of newly compacted
+    springs. When the accumulated rank exceeds max_rank, the current matrix
+    is factorized again (Z is a dense 2n x max_rank array).
+    '''
+
+    def __init__(self, max_rank=64, permc_spec='COLAMD'):
+        SparseLUSolver.__init__(self, permc_spec)
+        self.max_rank = max_rank
+
+    def factorize(self, A):
+        SparseLUSolver.factorize(self, A)
+        self.Z = None
+        self.V = None
+        self.C = None
+
+    @property
+    def rank(self):
+        '''Rank of the accumulated correction'''
+        return 0 if self.V is None else self.V.shape[0]
+
+    def update(self, A, U, V):
+        if self.rank + V.shape[0] > self.max_rank:
+            self.factorize(A)
+            return
+        # The first equation of the factorized matrix is ux[0] = 0: it is
+        # not modified by the compactions
+        U = U.tocsr(copy=True)
+        U.data[U.indptr[0]:U.indptr[1]] = 0.
+        Z = self.lu.solve(U.toarray())
+        if self.V is None:
+            self.Z = Z
+            self.V = V.tocsr()
+        else:
+            self.Z = numpy.hstack((self.Z, Z))
+            self.V = scipy.sparse.vstack((self.V, V)).tocsr()
+        C = numpy.eye(self.rank) + self.V @ self.Z
+        self.C = scipy.linalg.lu_factor(C)
+
+    def solve(self, F, x0=None):
+        u = SparseLUSolver.solve(self, F)
+        if self.V is None:
+            return u
+        return u - self.Z @ scipy.linalg.lu_solve(self.C, self.V @ u)
+
+
+class IterativeSolver:
+    '''Preconditioned Krylov solver, for the samples whose sparse
+    factorization needs too much memory. The system (with the equation
+    ux[0] = 0 of SparseLUSolver) is solved by BiCGSTAB or restarted GMRES,
+    both suited to the non-symmetric rows of the top and bottom borders,
+    from the initial guess x0 (the solution of the previous step), until
+    the relative residual is below tol.
+
+    The preconditioner is an incomplete LU factorization ('ilu', see
+    scipy.sparse.linalg.spilu for drop_tol and fill_factor) or the inverse
+    of the 2x2 blocks (ux, uy) of every node ('jacobi'). It is computed by
+    factorize and update, i.e. it is reused as long as the compaction state
+    does not change.
+
+    After every solve, last_iterations and residual are the number of
+    iterations and the relative residual of the solve, and iterations is
+    the total number of iterations since the creation of the solver.
+    '''
+
+    def __init__(self, method='bicgstab', preconditioner='ilu', tol=1e-10,
+                 maxiter=None, restart=50, drop_tol=1e-4, fill_factor=10):
+        if method not in ('bicgstab', 'gmres'):
+            raise ValueError("Unknown method '%s'" % method)
+        if preconditioner not in ('ilu', 'jacobi'):
+            raise ValueError("Unknown preconditioner '%s'" % preconditioner)
+        self.method = method
+        self.preconditioner = preconditioner
+        self.tol = tol
+        self.maxiter = maxiter
+        self.restart = restart
+        self.drop_tol = drop_tol
+        self.fill_factor = fill_factor
+        self.iterations = 0
+        self.last_iterations = 0
+        self.residual = None
+        self.max_restarts = 5
+
+    def factorize(self, A):
+        self.A = pin(A)
+        if self.preconditioner == 'ilu':
+            ilu = scipy.sparse.linalg.spilu(self.A.tocsc(),
+                                            drop_tol=self.drop_tol,
+                                            fill_factor=self.fill_factor)
+            self.M = scipy.sparse.linalg.LinearOperator(self.A.shape,
+                                                        ilu.solve)
+        else:
+            self.M = block_jacobi(self.A)
+
+    def update(self, A, U, V):
+        self.factorize(A)
+
+    def solve(self, F, x0=None):
+        F = F.copy()
+        F[0] = 0.
+        count = [0]
+
+        def callback(*args):
+            count[0] += 1
+
+        norm = numpy.linalg.norm(F) or 1.
+        u = x0
+        # BiCGSTAB breaks down (info < 0) when the preconditioner is so good
+        # that the residual vanishes in a few iterations: it is then
+        # restarted from the current solution
+        for restart in range(self.max_restarts + 1):
+            if self.method == 'gmres':
+                u, info = scipy.sparse.linalg.gmres(
+                    self.A, F, u, rtol=self.tol, atol=0.,
+                    restart=self.restart, maxiter=self.maxiter, M=self.M,
+                    callback=callback, callback_type='pr_norm')
+            else:
+                u, info = scipy.sparse.linalg.bicgstab(
+                    self.A, F, u, rtol=self.tol, atol=0.,
+                    maxiter=self.maxiter, M=self.M, callback=callback)
+            self.residual = numpy.linalg.norm(F - self.A @ u) / norm
+            if info >= 0 or self.residual <= self.tol:
+                break
+        self.last_iterations = count[0]
+        self.iterations += count[0]
+        if info != 0 and self.residual > self.tol:
+            raise RuntimeError("%s did not converge in %d iterations "
+                               "(relative residual %g)" %
+                               (self.method, count[0], self.residual))
+        return u
+
+
+class SymmetricSolver:
+    '''Solver of the symmetric positive definite reformulation of the
+    system. The imposed displacements uy of the top and bottom rows, and
+    ux[0] (translation), are eliminated: their columns are moved to the
+    right-hand side. The remaining equations of the top and bottom nodes
+    are divided by Kbc (the friction factor of their springs), which makes
+    the reduced matrix -A the symmetric stiffness matrix K of the network,
+    positive definite once the translation is fixed.
+
+    K is factorized by a sparse Cholesky factorization (scikit-sparse, if it
+    is installed, or else SuperLU in symmetric mode) with method='cholesky',
+    or the system is solved by conjugate gradients (Jacobi preconditioner,
+    initial guess x0, relative residual tol) with method='cg'. The solver
+    needs the layout of the sample: it is bound to the experiment by
+    Compression (see bind).
+    '''
+
+    def __init__(self, method='cholesky', tol=1e-10, maxiter=None):
+        if method not in ('cholesky', 'cg'):
+            raise ValueError("Unknown method '%s'" % method)
+        self.method = method
+        self.tol = tol
+        self.maxiter = maxiter
+        self.iterations = 0 if method == 'cg' else None
+        self.last_iterations = 0
+        self.residual = None
+
+    def bind(self, cpr):
+        '''Computes the degrees of freedom which are eliminated and the
+        scaling of the equations for the experiment cpr'''
+        rs = cpr.rs
+        n = rs.n
+        border = rs.top | rs.bottom
+        fixed = numpy.concatenate(([True], numpy.zeros(n - 1, dtype=bool),
+                                   border))
+        self.fixed = numpy.flatnonzero(fixed)
+        self.free = numpy.flatnonzero(~fixed)
+        scale = numpy.where(numpy.concatenate((border, numpy.zeros(n, bool))),
+                            1. / cpr.Kbc, 1.)
+        self.scale = scipy.sparse.diags(scale[self.free])
+
+    def factorize(self, A):
+        A = A.tocsr()[self.free]
+        K = -(self.scale @ A[:, self.free])
+        # the division by Kbc leaves round-off differences between K and K^T
+        self.K = ((K + K.T) / 2).tocsc()
+        self.K_fixed = -(self.scale @ A[:, self.fixed])
+        if self.method == 'cg':
+            self.M = scipy.sparse.diags(1. / self.K.diagonal())
+        elif cholmod is not None:
+            self.factor = cholmod.cholesky(self.K)
+        else:
+            lu = scipy.sparse.linalg.splu(
+                self.K, permc_spec='MMD_AT_PLUS_A', diag_pivot_thresh=0.,
+                options={'SymmetricMode': True})
+            self.factor = lu.solve
+
+    def update(self, A, U, V):
+        self.factorize(A)
+
+    def solve(self, F, x0=None):
+        u_fixed = F[self.fixed]
+        u_fixed[0] = 0.
+        b = -(self.scale @ F[self.free]) - self.K_fixed @ u_fixed
+        if self.method == 'cg':
+            count = [0]
+
+            def callback(x):
+                count[0] += 1
+
+            x, info = scipy.sparse.linalg.cg(
+                self.K, b, None if x0 is None else x0[self.free],
+                rtol=self.tol, atol=0., maxiter=self.maxiter, M=self.M,
+                callback=callback)
+            self.last_iterations = count[0]
+            self.iterations += count[0]
+            self.residual = (numpy.linalg.norm(b - self.K @ x) /
+                             (numpy.linalg.norm(b) or 1.))
+            if info != 0:
+                raise RuntimeError("cg did not converge in %d iterations "
+                                   "(relative residual %g)" %
+                                   (count[0], self.residual))
+        else:
+            x = self.factor(b)
+        u = numpy.empty(len(F))
+        u[self.free] = x
+        u[self.fixed] = u_fixed
+        return u
+
+
+class MultigridSolver(SymmetricSolver):
+    '''Geometric multigrid solver of the symmetric reformulation of the
+    system (see SymmetricSolver), used as preconditioner of conjugate
+    gradients: its cost per solve grows linearly with the number of nodes.
+
+    The hierarchy of lattices is built from the node layout: in the
+    coordinates (X, r) = (2 x / leq0, row), the nodes of the coarse lattice
+    are the nodes such that r and (X - r) / 2 are even. The coarse lattice
+    is a triangular lattice of spacing 2 leq0, and every other node is the
+    middle of a coarse spring: its displacement is interpolated linearly
+    from the two ends of the spring (prolongation P; near the borders,
+    from the nearest coarse nodes). The lattices are coarsened until there
+    are less than coarse_size degrees of freedom.
+
+    The coarse matrices P^T K P are computed from the stiffness K of the
+    current compaction state each time the compaction state changes. The
+    preconditioner is a V-cycle with smoothing damped Jacobi sweeps (weight
+    omega) before and after the coarse correction, and a direct solve on
+    the coarsest lattice.
+    '''
+
+    def __init__(self, tol=1e-10, maxiter=None, coarse_size=500, smoothing=2,
+                 omega=0.6):
+        SymmetricSolver.__init__(self, 'cg', tol, maxiter)
+        self.coarse_size = coarse_size
+        self.smoothing = smoothing
+        self.omega = omega
+
+    def bind(self, cpr):
+        SymmetricSolver.bind(self, cpr)
+        rs = cpr.rs
+        x, y = rs.node_coordinates()
+        X = numpy.rint(2 * x / rs.leq0).astype(int)
+        r = numpy.rint(y / (sqrt(3) / 2 * rs.leq0)).astype(int)
+        free = numpy.ones(2 * rs.n, dtype=bool)
+        free[self.fixed] = False
+        self.prolongations = []
+        while free.sum() > self.coarse_size:
+            P, coarse = node_prolongation(X, r)
+            if len(coarse) == len(X):
+                break
+            free_coarse = numpy.concatenate((free[:len(X)][coarse],
+                                             free[len(X):][coarse]))
+            P = scipy.sparse.block_diag((P, P), format='csr')
+            self.prolongations.append(P[free][:, free_coarse].tocsr())
+            X = X[coarse] // 2
+            r = r[coarse] // 2
+            free = free_coarse
+
+    def factorize(self, A):
+        SymmetricSolver.factorize(self, A)
+        self.levels = [self.K.tocsr()]
+        for P in self.prolongations:
+            self.levels.append((P.T @ self.levels[-1] @ P).tocsr())
+        self.inverse_diagonals = [1. / K.diagonal() for K in self.levels]
+        self.coarse_solve = scipy.sparse.linalg.splu(
+            self.levels[-1].tocsc()).solve
+        self.M = scipy.sparse.linalg.LinearOperator(self.K.shape,
+                                                    self.vcycle)
+
+    def vcycle(self, b, level=0):
+        '''Approximate solution of K x = b on the given level'''
+        b = numpy.ravel(b)
+        if level == len(self.prolongations):
+            return self.coarse_solve(b)
+        K = self.levels[level]
+        D = self.omega * self.inverse_diagonals[level]
+        P = self.prolongations[level]
+        x = D * b
+        for i in range(self.smoothing - 1):
+            x += D * (b - K @ x)
+        x += P @ self.vcycle(P.T @ (b - K @ x), level + 1)
+        for i in range(self.smoothing):
+            x += D * (b - K @ x)
+        return x
+
+
+def node_prolongation(X, r):
+    '''Returns the prolongation matrix (fine nodes x coarse nodes) and the
+    indices of the coarse nodes of the triangular lattice whose nodes have
+    the coordinates (X, r) (see MultigridSolver).'''
+    nodes = numpy.arange(len(X))
+    grid = numpy.full((r.max() + 3, X.max() + 5), -1)
+    grid[r + 1, X + 2] = nodes
+    is_coarse = (r % 2 == 0) & ((X - r) % 4 == 0)
+    coarse = numpy.flatnonzero(is_coarse)
+    coarse_index = numpy.full(len(X), -1)
+    coarse_index[coarse] = numpy.arange(len(coarse))
+
+    def coarse_at(dX, dr):
+        # coarse index of the neighbour (X + dX, r + dr), -1 if it does not
+        # exist or if it is not a coarse node
+        k = grid[r + 1 + dr, X + 2 + dX]
+        return numpy.where(k >= 0, coarse_index[k], -1)
+
+    rows = [coarse]
+    cols = [numpy.arange(len(coarse))]
+    weights = [numpy.ones(len(coarse))]
+    done = is_coarse.copy()
+    # midpoints of the horizontal and oblique coarse springs
+    for dX, dr in ((2, 0), (1, 1), (-1, 1)):
+        a = coarse_at(-dX, -dr)
+        b = coarse_at(dX, dr)
+        middle = ~done & (a >= 0) & (b >= 0)
+        for c in (a, b):
+            rows.append(nodes[middle])
+            cols.append(c[middle])
+            weights.append(numpy.full(middle.sum(), 0.5))
+        done |= middle
+    # borders: average of the nearest coarse nodes (scipy.spatial is slow
+    # to import, and only needed here)
+    rest = numpy.flatnonzero(~done)
+    if len(rest) > 0:
+        import scipy.spatial
+        tree = scipy.spatial.cKDTree(
+            numpy.array([X[coarse], r[coarse] * sqrt(3)]).T)
+        points = numpy.array([X[rest], r[rest] * sqrt(3)]).T
+        distance, index = tree.query(points, k=6)
+        nearest = distance <= distance[:, :1] * (1 + 1e-9)
+        count = nearest.sum(axis=1)
+        rows.append(numpy.repeat(rest, count))
+        cols.append(index[nearest])
+        weights.append(numpy.repeat(1. / count, count))
+    P = scipy.sparse.csr_matrix(
+        (numpy.concatenate(weights),
+         (numpy.concatenate(rows), numpy.concatenate(cols))),
+        shape=(len(X), len(coarse)))
+    return P, coarse
+
+
+def block_jacobi(A):
+    '''Returns the inverse of the block diagonal part of A made of the 2x2
+    blocks coupling ux[i] and uy[i] of every node i'''
+    n = A.shape[0] // 2
+    d = A.diagonal()
+    a, dd = d[:n], d[n:]
+    b = A.diagonal(n)
+    c = A.diagonal(-n)
+    det = a * dd - b * c
+    return scipy.sparse.diags([numpy.concatenate((dd, a)) / numpy.tile(det, 2),
+                               -b / det, -c / det], [0, n, -n], format='csr')
+
+
+def pin(A):
+    '''Returns a copy of the CSR matrix A whose first row is replaced by the
+    equation ux[0] = 0.'''
+    A = A.tocsr(copy=True)
+    A.data[A.indptr[0]:A.indptr[1]] = 0.
+    A[0, 0] = 1.
+    return A
+
+
+SOLVERS = {'dense': DenseSolver, 'sparse': SparseLUSolver,
+           'woodbury': WoodburySolver, 'iterative': IterativeSolver,
+           'symmetric': SymmetricSolver, 'multigrid': MultigridSolver}
+
+
+def get_solver(solver):
+    '''Returns a solver instance from its name (a key of SOLVERS) or returns
+    the solver unchanged if it is already an instance.'''
+    if isinstance(solver, str):
+        try:
+            return SOLVERS[solver]()
+        except KeyError:
+            raise ValueError("Unknown solver '%s', available solvers are: %s"
+                             % (solver, ', '.join(sorted(SOLVERS))))
+    return solver
+
+
+# Example: cost of the factorization and of one solve for the direct and
+# multigrid solvers, on lattices of growing size
+if __name__ == '__main__':
+    import time
+    from echantillon import RockSample
+    from compression import Compression
+
+    for nlines, ncols in ((51, 31), (101, 61), (201, 121), (301, 201),
+                          (501, 301)):
+        for name in ('sparse', 'symmetric', 'multigrid'):
+            cpr = Compression(RockSample(nlines, ncols, D = 0.05, seed = 1),
+                              solver = name)
+            cpr.d = 1.
+            cpr.solve(compact = False)
+            start = time.time()
+            cpr.solver.factorize(cpr.A)
+            factorize = time.time() - start
+            start = time.time()
+            cpr.solver.solve(cpr.F.copy())
+            print("%6d nodes, %-9s factorize %7.3f s, solve %6.3f s" %
+                  (cpr.rs.n, name, factorize, time.time() - start))
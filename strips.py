@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+#
+# Strip by strip evaluation of the quantities of the springs and of the
+# nodes of a rock sample. The springs (and the nodes) are numbered row by
+# row, so that a range of indices is a horizontal strip of the lattice. The
+# strips are small enough to stay in the cache, and they are evaluated in
+# parallel by a pool of threads: the numpy operations on arrays release the
+# GIL. The results are returned in the order of the strips, so that they
+# do not depend on the number of threads.
+
+import concurrent.futures
+
+import numpy
+
+
+class StripPool:
+    '''Pool of worker threads evaluating a function on the strips of
+    strip_size consecutive indices of an array:
+
+        pool = StripPool(4)
+        new = numpy.concatenate(pool.map(function, rs.nsprings))
+
+    where function(s) computes the result of the strip s (a slice). With
+    one worker, the strips are evaluated one after the other by the calling
+    thread.'''
+
+    def __init__(self, workers=1, strip_size=16384):
+        self.workers = workers
+        self.strip_size = strip_size
+        self.executor = (concurrent.futures.ThreadPoolExecutor(workers)
+                         if workers > 1 else None)
+
+    def strips(self, size):
+        '''Returns the strips (slices) of an array of the given size'''
+        return [slice(start, min(start + self.strip_size, size))
+                for start in range(0, size, self.strip_size)]
+
+    def map(self, function, size):
+        '''Returns the list of the results of function on the strips of an
+        array of the given size, in the order of the strips'''
+        strips = self.strips(size)
+        if self.executor is None or len(strips) <= 1:
+            return [function(s) for s in strips]
+        return list(self.executor.map(function, strips))
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+
+
+def map_strips(function, size, pool=None):
+    '''Evaluates function on the strips of an array of the given size with
+    the pool, or on the whole array (one strip) if pool is None'''
+    if pool is None:
+        return [function(slice(0, size))]
+    return pool.map(function, size)
+
+
+# Example: speedup of the compaction checks of a large sample
+if __name__ == '__main__':
+    import os
+    import time
+    from echantillon import RockSample
+
+    rs = RockSample(701, 401, D = 0.05, seed = 1)
+    rs.u = numpy.random.default_rng(1).normal(0., 0.01, 2 * rs.n)
+    compacted = rs.compacted.copy()
+    for workers in [None] + sorted({1, 2, 4, os.cpu_count()}):
+        pool = None if workers is None else StripPool(workers)
+        start = time.time()
+        for i in range(10):
+            rs.compacted[:] = compacted
+            rs.find_compacted(Kbc = 20, pool = pool)
+        print("%s: %.1f ms per check of %d springs" %
+              ("whole array" if pool is None else "%d threads" % workers,
+               (time.time() - start) * 100, rs.nsprings))
+        if pool is not None:
+            pool.close()
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+#
+# Parameter sweeps: the compression experiment is run for every point of a
+# design (grid, random or Latin hypercube) over the parameters of the rock
+# sample and of the experiment, and one line of results per point is
+# appended to a CSV file.
+
+import os
+import csv
+import json
+import time
+import inspect
+import itertools
+import concurrent.futures
+
+import numpy
+
+from echantillon import RockSample
+from compression import Compression
+
+
+def grid(**values):
+    '''Full factorial design: returns the list of the points (dictionaries)
+    of the cartesian product of the lists of values of every parameter.
+    Example: grid(F0x=[0, 0.01], Kbc=[10, 20, 40])'''
+    names = list(values)
+    return [dict(zip(names, point))
+            for point in itertools.product(*(values[name] for name in names))]
+
+
+def random_design(npoints, seed=None, **ranges):
+    '''Returns npoints points whose parameters are drawn uniformly in the
+    ranges (low, high) given for every parameter.
+    Example: random_design(20, D=(0, 0.1), dip=(0, 90))'''
+    rng = numpy.random.default_rng(seed)
+    samples = {name: rng.uniform(low, high, npoints)
+               for name, (low, high) in ranges.items()}
+    return [{name: float(samples[name][i]) for name in ranges}
+            for i in range(npoints)]
+
+
+def latin_hypercube(npoints, seed=None, **ranges):
+    '''Latin hypercube design: the range (low, high) of every parameter is
+    divided into npoints intervals of equal width, and every interval is
+    used by exactly one of the npoints points.'''
+    rng = numpy.random.default_rng(seed)
+    samples = {}
+    for name, (low, high) in ranges.items():
+        u = (rng.permutation(npoints) + rng.random(npoints)) / npoints
+        samples[name] = low + u * (high - low)
+    return [{name: float(samples[name][i]) for name in ranges}
+            for i in range(npoints)]
+
+
+def parameter_defaults(function):
+    '''Returns the dictionary of the parameters of function having a default
+    value'''
+    return {name: parameter.default
+            for name, parameter in inspect.signature(function).parameters.items()
+            if parameter.default is not inspect.Parameter.empty}
+
+
+def store_value(value):
+    '''Form of a parameter value in the store: lists and dictionaries (e.g.
+    the layers of a StratifiedRockSample) are written in JSON, with sorted
+    keys'''
+    if isinstance(value, (list, tuple, dict)):
+        return json.dumps(value, sort_keys=True)
+    return value
+
+
+def normalize(value):
+    '''Canonical form of a parameter value: numbers (and booleans) are
+    converted to float so that 20, 20.0 and '20' (as read from the store)
+    are the same point, and lists and dictionaries are converted to their
+    form in the store'''
+    if isinstance(value, (list, tuple, dict)):
+        return store_value(value)
+    if value is None or value == '':
+        return None
+    if value in ('True', 'False'):
+        return float(value == 'True')
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return value
+
+
+def run_point(sample_class, sample_args, compression_args):
+    '''Runs one compression experiment and returns the summary of its
+    results (dictionary)'''
+    start = time.time()
+    rs = sample_class(**sample_args)
+    step = None
+    Fy_max = strain_Fy_max = first_compaction = None
+    with Compression(rs, **compression_args) as cpr:
+        for step in cpr.run():
+            if Fy_max is None or step.Fy > Fy_max:
+                Fy_max = step.Fy
+                strain_Fy_max = step.strain
+            if first_compaction is None and len(step.new) > 0:
+                first_compaction = step.strain
+    return {'iterations': cpr.iteration,
+            'strain': step.strain if step else None,
+            'Fy': step.Fy if step else None,
+            'comp_rate': step.comp_rate if step else None,
+            'Fy_max': Fy_max,
+            'strain_Fy_max': strain_Fy_max,
+            'first_compaction_strain': first_compaction,
+            'time': time.time() - start}
+
+
+class Sweep:
+    '''Sweep of the compression experiment over a list of points.
+
+    Every point is a dictionary of parameters of sample_class (nlines,
+    ncols, D, Rl, dip, ... and seed) and of Compression (F0x, Kbc, delta_d,
+    ...). The parameters missing from a point take their default values, so
+    that identical points written differently are only run once. The
+    solver and the number of threads (workers) of Compression may also be
+    given: they have no influence on the results, so they are not part of
+    the key of the point in the store. The
+    points already present in the store (a CSV file) are skipped, and the
+    results of every new point are appended to the store as soon as they
+    are available: an interrupted sweep is resumed by running it again.
+
+    The points are run by a pool of processes, the most expensive first
+    (see cost) so that a long run does not start at the end of the sweep.
+    '''
+
+    # Results computed by run_point, in the order of the columns of the store
+    results = ['iterations', 'strain', 'Fy', 'comp_rate', 'Fy_max',
+               'strain_Fy_max', 'first_compaction_strain', 'time']
+
+    # Parameters which have no influence on the results (they are not part
+    # of the key of a point, but they are passed to Compression)
+    ignored = ['rs', 'solver', 'workers']
+
+    def __init__(self, points, sample_class=RockSample, store='sweep.csv',
+                 processes=None):
+        self.sample_class = sample_class
+        self.store = store
+        self.processes = processes or os.cpu_count()
+        self.sample_defaults = parameter_defaults(sample_class.__init__)
+        self.compression_defaults = parameter_defaults(Compression.__init__)
+        for name in self.ignored:
+            self.compression_defaults.pop(name, None)
+        required = [name for name in
+                    inspect.signature(sample_class.__init__).parameters
+                    if name != 'self' and name not in self.sample_defaults]
+        self.parameters = required + sorted(
+            set(self.sample_defaults) | set(self.compression_defaults))
+        self.failed = {}
+
+        # Complete points, without duplicates, in the order of the list
+        self.points = []
+        keys = set()
+        for point in points:
+            unknown = set(point) - set(self.parameters) - set(self.ignored)
+            if unknown:
+                raise ValueError("Unknown parameters: %s" %
+                                 ', '.join(sorted(unknown)))
+            missing = [name for name in required if name not in point]
+            if missing:
+                raise ValueError("Missing parameters: %s" %
+                                 ', '.join(missing))
+            point = {**self.sample_defaults, **self.compression_defaults,
+                     **point}
+            key = self.key(point)
+            if key not in keys:
+                keys.add(key)
+                self.points.append(point)
+
+    def key(self, point):
+        '''Key identifying a point in the store'''
+        return tuple(normalize(point.get(name)) for name in self.parameters)
+
+    def done(self):
+        '''Returns the set of the keys of the points already in the store'''
+        if not os.path.exists(self.store):
+            return set()
+        with open(self.store, newline='') as f:
+            return {self.key(row) for row in csv.DictReader(f)}
+
+    @staticmethod
+    def cost(point):
+        '''Rough estimate of the relative cost of a point: the cost of a
+        solve grows like n^1.5 for a lattice of n nodes, and the number of
+        steps like 1/|delta_d| (or like the number of springs in event driven
+        mode). The cost of a point with delta_d = 0 is infinite.'''
+        n = point['nlines'] * point['ncols']
+        if point.get('event_driven'):
+            steps = 3 * n * point['max_comp'] / 100
+        elif point['delta_d'] == 0:
+            steps = numpy.inf
+        else:
+            steps = 1 / abs(point['delta_d'])
+        return n ** 1.5 * steps
+
+    def split(self, point):
+        '''Splits the parameters of a point into the arguments of
+        sample_class and of Compression'''
+        sample_args = {name: value for name, value in point.items()
+                       if name not in self.compression_defaults and
+                       name not in self.ignored}
+        compression_args = {name: value for name, value in point.items()
+                            if name in self.compression_defaults or
+                            name in self.ignored}
+        return sample_args, compression_args
+
+    def run(self):
+        '''Runs the points which are not in the store yet. Generator
+        yielding the rows (dictionaries) appended to the store.'''
+        done = self.done()
+        todo = [point for point in self.points if self.key(point) not in done]
+        todo.sort(key=self.cost, reverse=True)
+        if not todo:
+            return
+
+        new_file = not os.path.exists(self.store)
+        with open(self.store, 'a', newline='') as f, \
+             concurrent.futures.ProcessPoolExecutor(self.processes) as pool:
+            writer = csv.DictWriter(f, self.parameters + self.results)
+            if new_file:
+                writer.writeheader()
+            # The executor starts the tasks in the order of submission
+            futures = {pool.submit(run_point, self.sample_class,
+                                   *self.split(point)): point
+                       for point in todo}
+            for future in concurrent.futures.as_completed(futures):
+                point = futures[future]
+                try:
+                    results = future.result()
+                except Exception as error:
+                    self.failed[self.key(point)] = repr(error)
+                    continue
+                row = dict({name: store_value(point[name])
+                            for name in self.parameters}, **results)
+                writer.writerow(row)
+                f.flush()
+                yield row
+
+    def table(self):
+        '''Returns the store as a dictionary of columns (numpy arrays)'''
+        with open(self.store, newline='') as f:
+            rows = list(csv.DictReader(f))
+        columns = {}
+        for name in self.parameters + self.results:
+            values = [normalize(row[name]) for row in rows]
+            if all(isinstance(value, float) or value is None
+                   for value in values):
+                values = [numpy.nan if value is None else value
+                          for value in values]
+            columns[name] = numpy.array(values)
+        return columns
+
+
+# Example: influence of the confinement and of the friction on a small
+# sample
+if __name__ == '__main__':
+    points = grid(nlines=[23], ncols=[15], D=[0.05], seed=[1],
+                  F0x=[0, 0.005], Kbc=[10, 20], event_driven=[True],
+                  solver=['symmetric'], workers=[2])
+    sweep = Sweep(points, store='sweep.csv')
+    for row in sweep.run():
+        print("F0x = %g, Kbc = %g: Fy max = %f at %.2f %% (%.1f s)" %
+              (row['F0x'], row['Kbc'], row['Fy_max'], row['strain_Fy_max'],
+               row['time']))
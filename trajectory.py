@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+#
+# On-disk trajectories of compression experiments: the displacement field
+# rs.u and the applied displacement, vertical force and compaction rate of
+# every step (or of every stride-th step) are appended to raw binary files
+# which are read back as numpy memory maps.
+#
+# A trajectory is a directory containing:
+#   meta.json   number of nodes, dtype of u, stride and number of steps
+#   steps.dat   one record (iteration, d, strain, Fy, comp_rate) per step
+#   u.dat       one row of 2n displacements (ux then uy) per step
+# The data files are pre-allocated by chunks of steps and truncated to the
+# number of steps when the writer is closed.
+
+import os
+import json
+
+import numpy
+
+# Record of the scalar quantities of a step in steps.dat
+STEP_DTYPE = numpy.dtype([('iteration', '<i8'), ('d', '<f8'),
+                          ('strain', '<f8'), ('Fy', '<f8'),
+                          ('comp_rate', '<f8')])
+
+
+class TrajectoryWriter:
+    '''Appends the steps of a compression experiment to the trajectory
+    directory path, for a sample of n nodes:
+
+        with TrajectoryWriter('run.traj', rs.n) as trajectory:
+            for step in cpr.run():
+                trajectory.append(step, rs.u)
+
+    u is stored with the given dtype ('float32' halves the size of the
+    file), and only one step out of stride is kept. The files grow by
+    chunks of chunk steps. If append is True and the trajectory exists, the
+    new steps are added after the existing ones (e.g. when an experiment is
+    resumed from a checkpoint); n, dtype and stride must then be those of
+    the trajectory.
+    '''
+
+    def __init__(self, path, n, dtype='float64', stride=1, chunk=256,
+                 append=False):
+        self.path = path
+        self.n = n
+        self.dtype = numpy.dtype(dtype)
+        self.stride = stride
+        self.chunk = chunk
+        self.count = 0
+        # number of calls to append (for the stride)
+        self.calls = 0
+        os.makedirs(path, exist_ok=True)
+        if append and os.path.exists(os.path.join(path, 'meta.json')):
+            meta = read_meta(path)
+            if meta['n'] != n or numpy.dtype(meta['dtype']) != self.dtype:
+                raise ValueError("Trajectory %s has %d nodes and dtype %s" %
+                                 (path, meta['n'], meta['dtype']))
+            if meta['stride'] != stride:
+                raise ValueError("Trajectory %s has stride %d" %
+                                 (path, meta['stride']))
+            self.count = meta['count']
+            self.calls = meta['calls']
+        self.capacity = 0
+        self.grow(self.count + chunk)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def grow(self, capacity):
+        '''Resizes the data files for capacity steps and maps them again'''
+        self.capacity = capacity
+        self.steps = self.resize('steps.dat', STEP_DTYPE, ())
+        self.u = self.resize('u.dat', self.dtype, (2 * self.n,))
+
+    def resize(self, name, dtype, shape):
+        filename = os.path.join(self.path, name)
+        with open(filename, 'ab') as f:
+            f.truncate(self.capacity * dtype.itemsize *
+                       int(numpy.prod(shape)))
+        return numpy.memmap(filename, dtype, 'r+',
+                            shape=(self.capacity,) + shape)
+
+    def append(self, step, u):
+        '''Appends a step (compression.Step) and the displacements u of the
+        nodes, unless the step is skipped by the stride'''
+        self.calls += 1
+        if (self.calls - 1) % self.stride != 0:
+            return
+        if self.count == self.capacity:
+            self.flush()
+            self.grow(self.capacity + self.chunk)
+        self.steps[self.count] = (step.iteration, step.d, step.strain,
+                                  step.Fy, step.comp_rate)
+        self.u[self.count] = u
+        self.count += 1
+
+    def flush(self):
+        '''Writes the data and the number of steps to the disk: the steps
+        appended so far can be read while the experiment goes on.'''
+        self.steps.flush()
+        self.u.flush()
+        meta = {'n': self.n, 'dtype': self.dtype.str, 'stride': self.stride,
+                'count': self.count, 'calls': self.calls}
+        tmp = os.path.join(self.path, 'meta.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, os.path.join(self.path, 'meta.json'))
+
+    def close(self):
+        self.flush()
+        del self.steps, self.u
+        self.capacity = self.count
+        for name, dtype, size in (('steps.dat', STEP_DTYPE, 1),
+                                  ('u.dat', self.dtype, 2 * self.n)):
+            with open(os.path.join(self.path, name), 'ab') as f:
+                f.truncate(self.count * dtype.itemsize * size)
+
+
+def read_meta(path):
+    with open(os.path.join(path, 'meta.json')) as f:
+        return json.load(f)
+
+
+class Trajectory:
+    '''Read access to a trajectory written by TrajectoryWriter. The files
+    are memory mapped: only the parts which are accessed are read.
+
+    steps is a record array (fields iteration, d, strain, Fy, comp_rate)
+    and u a (number of steps, 2n) array, both with one line per stored
+    step.'''
+
+    def __init__(self, path):
+        self.path = path
+        meta = read_meta(path)
+        self.n = meta['n']
+        self.stride = meta['stride']
+        self.count = meta['count']
+        dtype = numpy.dtype(meta['dtype'])
+        if self.count > 0:
+            self.steps = numpy.memmap(os.path.join(path, 'steps.dat'),
+                                      STEP_DTYPE, 'r', shape=(self.count,))
+            self.u = numpy.memmap(os.path.join(path, 'u.dat'), dtype, 'r',
+                                  shape=(self.count, 2 * self.n))
+        else:
+            self.steps = numpy.zeros(0, STEP_DTYPE)
+            self.u = numpy.zeros((0, 2 * self.n), dtype)
+
+    def __len__(self):
+        return self.count
+
+    def __getattr__(self, name):
+        # columns of steps: trajectory.d, trajectory.Fy, ...
+        if name in STEP_DTYPE.names:
+            return self.steps[name]
+        raise AttributeError(name)
+
+    def step(self, index):
+        '''Returns the displacements (ux, uy) of all the nodes at the
+        stored step index'''
+        u = self.u[index]
+        return u[:self.n], u[self.n:]
+
+    def node(self, i):
+        '''Returns the histories (ux, uy) of the displacement of node i'''
+        return self.u[:, i], self.u[:, self.n + i]
+
+
+# Example: trajectory of a small sample
+if __name__ == '__main__':
+    from echantillon import RockSample
+    from compression import Compression
+
+    rs = RockSample(23, 15, D = 0.02, seed = 1)
+    cpr = Compression(rs, event_driven = True)
+    with TrajectoryWriter('example.traj', rs.n, dtype = 'float32',
+                          stride = 2) as writer:
+        for step in cpr.run():
+            writer.append(step, rs.u)
+
+    trajectory = Trajectory('example.traj')
+    print("%d steps stored" % len(trajectory))
+    ux, uy = trajectory.node(rs.n // 2)
+    print("Vertical displacement of the central node:", uy[::10])